@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# Copyright © 2017-2020 jianglin
+# File Name: benchmark.py
+# Author: jianglin
+# Email: xiyang0807@gmail.com
+# Created: 2020-08-20 10:12:31 (CST)
+# Last Update:
+#          By:
+# Description:
+# **************************************************************************
+import random
+import re
+import subprocess
+import sys
+import timeit
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from orgpython import src, to_html
+from orgpython.document import Document
+from orgpython.inline import html_escape
+from orgpython.visitor import Visitor
+
+PATHOLOGICAL = (
+    "a* ",
+    "\\*a ",
+    "/=x",
+    "/*x",
+    "_\\_ ",
+)
+
+
+def measure(func, number=3):
+    return min(timeit.repeat(func, number=1, repeat=number))
+
+
+def bench_emphasis(sizes=(1000, 2000, 4000, 8000), inline_engine="default"):
+    print("emphasis: pathological lines, seconds per render ({0})".format(
+        inline_engine))
+    for pattern in PATHOLOGICAL:
+        times = []
+        for size in sizes:
+            text = pattern * size
+            times.append(
+                measure(lambda: to_html(text, inline_engine=inline_engine)))
+
+        ratio = times[-1] / max(times[0], 1e-9)
+        growth = float(sizes[-1]) / sizes[0]
+        print("  {0!r:8} {1}  x{2:.1f} for x{3:.0f} input".format(
+            pattern,
+            " ".join("{0:.4f}".format(t) for t in times),
+            ratio,
+            growth,
+        ))
+
+
+def bench_unterminated(sizes=(1000, 2000, 4000, 8000)):
+    print("unterminated: unclosed blocks and drawers, seconds per render")
+    for opener in ("#+BEGIN_SRC python", ":PROPERTIES:", "#+RESULTS:"):
+        times = []
+        for size in sizes:
+            text = "\n".join([opener, ": text"] * size)
+            times.append(measure(lambda: to_html(text)))
+
+        ratio = times[-1] / max(times[0], 1e-9)
+        growth = float(sizes[-1]) / sizes[0]
+        print("  {0!r:22} {1}  x{2:.1f} for x{3:.0f} input".format(
+            opener,
+            " ".join("{0:.4f}".format(t) for t in times),
+            ratio,
+            growth,
+        ))
+
+
+def bench_highlight(blocks=300):
+    print("highlight: {0} src blocks, seconds per render".format(blocks))
+    snippets = (
+        ("python", "def f(x):\n    return {'a': x}"),
+        ("sh", "pip install org-python"),
+        ("emacs-lisp", "(setq a 1)"),
+        ("conf-unix", "[section]\nkey = value"),
+    )
+    lines = []
+    for i in range(blocks):
+        language, code = snippets[i % len(snippets)]
+        code = "{0}\n{1}".format(code, i)
+        lines.extend(["#+BEGIN_SRC " + language, code, "#+END_SRC"])
+    text = "\n".join(lines)
+
+    def render(guess, cached):
+        if not cached:
+            src.highlight_cache.clear()
+        return to_html(text, highlight=True, guess_lexer=guess)
+
+    for guess in (True, "language", False):
+        for cached in (False, True):
+            src.timings.reset()
+            seconds = measure(lambda: render(guess, cached))
+            per_block = src.timings.seconds / max(src.timings.count, 1)
+            print("  guess_lexer={0!r:10} {1:5} {2:.4f}  {3:.6f} per block"
+                  .format(guess, "warm" if cached else "cold", seconds,
+                          per_block))
+
+    with ProcessPoolExecutor() as executor:
+        for guess in (True, "language", False):
+            src.highlight_cache.clear()
+            seconds = measure(lambda: (src.highlight_cache.clear(), to_html(
+                text,
+                highlight=True,
+                guess_lexer=guess,
+                highlight_executor=executor,
+            )))
+            print("  guess_lexer={0!r:10} bulk  {1:.4f}".format(
+                guess, seconds))
+
+
+def import_times(module):
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stderr
+
+    times = {}
+    for line in output.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def bench_import(number=5, module="orgpython"):
+    print("import: python -X importtime -c 'import {0}', seconds".format(
+        module))
+    runs = [import_times(module) for _ in range(number)]
+    best = min(runs, key=lambda times: times[module])
+    print("  {0:24} {1:.4f}".format(module, best[module]))
+    for name in ("pygments", "concurrent.futures", "multiprocessing"):
+        print("  {0:24} {1}".format(
+            name,
+            "{0:.4f}".format(best[name]) if name in best else "not imported",
+        ))
+
+
+HTML_ESCAPES = (
+    ("&", "&amp;"),
+    ("'", "&#39;"),
+    ("<", "&lt;"),
+    (">", "&gt;"),
+    ("\"", "&#34;"),
+)
+HTML_ESCAPE_TABLE = {ord(char): entity for char, entity in HTML_ESCAPES}
+HTML_ESCAPE_REGEXP = re.compile(r"[&'<>\"]")
+
+
+def escape_loop(text):
+    for char, entity in HTML_ESCAPES:
+        text = text.replace(char, entity)
+    return text
+
+
+def escape_translate(text):
+    return text.translate(HTML_ESCAPE_TABLE)
+
+
+def escape_regexp(text):
+    if HTML_ESCAPE_REGEXP.search(text) is None:
+        return text
+    return HTML_ESCAPE_REGEXP.sub(
+        lambda match: HTML_ESCAPE_TABLE[ord(match.group())], text)
+
+
+def prose(lines=50000, seed=0):
+    words = (
+        "the of and to in a is that for it as was with be by on not this "
+        "are or from at which but have an they you were one all we their "
+        "orgmode python html 中文 标点 <b> & 'quoted' \"said\""
+    ).split()
+    r = random.Random(seed)
+    return [" ".join(r.choice(words) for _ in range(14)) for _ in range(lines)]
+
+
+def bench_escape(lines=50000):
+    print("escape: {0} prose lines, seconds per pass".format(lines))
+    corpus = prose(lines)
+    escapers = (
+        ("replace loop", escape_loop),
+        ("str.translate", escape_translate),
+        ("re.sub", escape_regexp),
+        ("html_escape", html_escape),
+    )
+    for name, escape in escapers:
+        assert [escape(line) for line in corpus] == [
+            escape_loop(line) for line in corpus
+        ]
+        seconds = measure(lambda: [escape(line) for line in corpus], 5)
+        print("  {0:14} {1:.4f}".format(name, seconds))
+
+    doc = Document("\n".join(corpus[:10000]))
+    print("  {0:14} {1:.4f}".format("first render", measure(doc.to_html, 1)))
+    print("  {0:14} {1:.4f}".format("next render", measure(doc.to_html)))
+
+
+def csv_table(cells, columns=10):
+    table = ["| " + " | ".join(["h"] * columns) + " |", "|---|"]
+    for row in range(cells // columns):
+        values = ("c{0}".format(row * columns + col) for col in range(columns))
+        table.append("| " + " | ".join(values) + " |")
+    return "\n".join(table)
+
+
+def bench_table(sizes=(10000, 100000)):
+    print("table: seconds per render, default and fast table engine")
+    for cells in sizes:
+        text = csv_table(cells)
+        times = [
+            measure(lambda: to_html(text, table_engine=engine))
+            for engine in ("default", "fast")
+        ]
+        print("  {0:8} cells {1:.3f} {2:.3f}  x{3:.1f}".format(
+            cells, times[0], times[1], times[0] / max(times[1], 1e-9)))
+
+
+def checklist(items, depth=4):
+    lines = []
+    for num in range(items):
+        lines.append("{0}- [{1}] item {2}".format(
+            "  " * (num % depth), " X-"[num % 3], num))
+    return "\n".join(lines)
+
+
+def bench_list(sizes=(10000, 100000)):
+    print("list: seconds per parse of a nested checklist, default and fast "
+          "list engine")
+    for items in sizes:
+        lines = checklist(items).splitlines()
+        times = [
+            measure(lambda: Document("", list_engine=engine).preparse(lines))
+            for engine in ("default", "fast")
+        ]
+        print("  {0:8} items {1:.3f} {2:.3f}  x{3:.1f}".format(
+            items, times[0], times[1], times[0] / max(times[1], 1e-9)))
+
+
+class LinkVisitor(Visitor):
+    def __init__(self):
+        self.links = []
+
+    def visit_link(self, node, depth):
+        self.links.append(node.content)
+
+
+def bench_walk(lines=20000, section=20):
+    print("walk: seconds to parse and render {0} lines, or walk them "
+          "and collect links".format(lines))
+    text = prose(lines)
+    for num in range(0, lines, section):
+        text[num] = "* headline {0}".format(num)
+        text[num + 1] = "[[https://example.com/{0}][link]]".format(num)
+    text = "\n".join(text)
+    options = {"inline_engine": "fast"}
+
+    def walk():
+        for _ in Document(text, **options).walk():
+            pass
+
+    for name, func in (
+        ("to_html", lambda: Document(text, **options).to_html()),
+        ("walk", walk),
+        ("links", lambda: LinkVisitor().run(Document(text, **options),
+                                            inline=True)),
+    ):
+        print("  {0:8} {1:.4f}".format(name, measure(func)))
+
+
+def bench_render(lines=20000, section=20):
+    print("render: seconds to export {0} lines to html and text, one "
+          "document each or one walk for both".format(lines))
+    text = prose(lines)
+    for num in range(0, lines, section):
+        text[num] = "* headline {0}".format(num)
+        text[num + 1] = "- item [[https://example.com/{0}][link]]".format(num)
+    text = "\n".join(text)
+    options = {"inline_engine": "fast"}
+
+    def separate():
+        Document(text, **options).to_html()
+        Document(text, **options).to_text()
+
+    for name, func in (
+        ("separate", separate),
+        ("render", lambda: Document(text, **options).render(("html", "text"))),
+    ):
+        print("  {0:8} {1:.4f}".format(name, measure(func)))
+
+
+def bench_update(lines=5000, section=20):
+    print("update: seconds per keystroke in a {0} line document".format(
+        lines))
+    text = prose(lines)
+    for num in range(0, lines, section):
+        text[num] = "* headline {0}".format(num)
+    middle = lines // 2 + 1
+
+    def full():
+        text[middle] += "x"
+        to_html("\n".join(text), toc="t")
+
+    doc = Document("\n".join(text), toc="t")
+    doc.update([])
+    doc.to_html()
+
+    def update():
+        line = doc.lines[middle] + "x"
+        doc.update([(middle, middle + 1, [line])])
+        doc.to_html()
+
+    full_time, update_time = measure(full), measure(update)
+    print("  to_html {0:.4f}  update {1:.4f}  x{2:.0f}".format(
+        full_time, update_time, full_time / max(update_time, 1e-9)))
+
+
+def bench_nesting(depths=(10, 100, 500), lines=5000):
+    print("nesting: seconds to parse {0} lines, flat and below a deep "
+          "outline".format(lines))
+    for depth in depths:
+        outlines = (
+            ("headlines", ["*" * num + " h" for num in range(1, depth + 1)],
+             "text"),
+            ("lists", [" " * num + "- item" for num in range(depth)],
+             " " * depth + "  text"),
+        )
+        for name, outline, line in outlines:
+            times = []
+            for text in ([line] * lines, outline + [line] * lines):
+                text = "\n".join(text)
+                times.append(measure(lambda: Document(text).preparse(
+                    text.splitlines())))
+            print("  {0:5} {1:9} {2:.4f} {3:.4f}".format(
+                depth, name, times[0], times[1]))
+
+
+def bench_memory(cells=100000, lines=20000):
+    print("memory: tracemalloc MiB held by a rendered tree, and peak")
+    texts = (
+        ("{0} table cells".format(cells), csv_table(cells)),
+        ("{0} prose lines".format(lines), "\n".join(prose(lines))),
+    )
+    for name, text in texts:
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        doc = Document(text)
+        doc.to_html()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del doc
+        print("  {0:20} {1:8.1f} {2:8.1f}".format(
+            name, (current - start) / 2.0**20, (peak - start) / 2.0**20))
+
+
+BENCHMARKS = {
+    "emphasis": bench_emphasis,
+    "emphasis-fast": lambda: bench_emphasis(inline_engine="fast"),
+    "escape": bench_escape,
+    "highlight": bench_highlight,
+    "import": bench_import,
+    "list": bench_list,
+    "memory": bench_memory,
+    "nesting": bench_nesting,
+    "render": bench_render,
+    "table": bench_table,
+    "unterminated": bench_unterminated,
+    "update": bench_update,
+    "walk": bench_walk,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
@@ -10,15 +10,123 @@
 #          By:
 # Description:
 # ********************************************************************************
+import mmap
+import os
+from collections import namedtuple
+
+from .cache import html_cache
 from .document import Document
 
+ConvertResult = namedtuple("ConvertResult", ["source", "html", "error"])
+
+
+def iter_file_lines(path, encoding="utf-8"):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            start = 0
+            while True:
+                end = m.find(b"\n", start)
+                if end < 0:
+                    break
+                yield m[start:end].decode(encoding)
+                start = end + 1
+            if start < len(m):
+                yield m[start:].decode(encoding)
+
 
 def to_text(content, **kwargs):
     return Document(content, **kwargs).to_text()
 
 
-def to_html(content, **kwargs):
-    return Document(content, **kwargs).to_html()
+def to_html(content, cache=False, **kwargs):
+    if cache is None or cache is False:
+        return Document(content, **kwargs).to_html()
+
+    if cache is True:
+        cache = html_cache
+    key = cache.key(content, **kwargs)
+    text = cache.get(key)
+    if text is None:
+        text = Document(content, **kwargs).to_html()
+        cache.set(key, text)
+    return text
+
+
+def iter_html(content, **kwargs):
+    return Document(content, **kwargs).iter_html()
+
+
+def parse_file(fp, **kwargs):
+    return Document.from_stream(fp, **kwargs)
+
+
+def to_html_file(path, encoding="utf-8", **kwargs):
+    lines = iter_file_lines(path, encoding)
+    return Document.from_stream(lines, **kwargs).to_html()
+
+
+def _convert(source, paths, encoding, options):
+    if paths or isinstance(source, os.PathLike):
+        return to_html_file(source, encoding, **options)
+    return to_html(source, **options)
+
+
+def _convert_chunk(chunk, paths, encoding, options):
+    results = []
+    for index, source in chunk:
+        try:
+            html = _convert(source, paths, encoding, options)
+            results.append((index, html, None))
+        except Exception as e:
+            results.append((index, None, e))
+    return results
+
+
+def convert_many(sources,
+                 workers=None,
+                 ordered=True,
+                 chunksize=None,
+                 encoding="utf-8",
+                 paths=False,
+                 **kwargs):
+    sources = list(sources)
+    items = list(enumerate(sources))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, len(items) // (workers * 4))
+    chunks = [
+        items[i:i + chunksize] for i in range(0, len(items), chunksize)
+    ]
+
+    if workers <= 1:
+        for chunk in chunks:
+            results = _convert_chunk(chunk, paths, encoding, kwargs)
+            for index, html, error in results:
+                yield ConvertResult(sources[index], html, error)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    args = (paths, encoding, kwargs)
+    with ProcessPoolExecutor(workers) as executor:
+        futures = {
+            executor.submit(_convert_chunk, chunk, *args): chunk
+            for chunk in chunks
+        }
+        try:
+            for future in futures if ordered else as_completed(futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    results = [(i, None, e) for i, _ in futures[future]]
+                for index, html, error in results:
+                    yield ConvertResult(sources[index], html, error)
+        finally:
+            for future in futures:
+                future.cancel()
 
 
 def to_markdown(content, **kwargs):
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ********************************************************************************
+# Copyright © 2017-2020 jianglin
+# File Name: cache.py
+# Author: jianglin
+# Email: mail@honmaple.com
+# Created: 2020-08-20 15:32:10 (CST)
+# Last Update:
+#          By:
+# Description:
+# ********************************************************************************
+import sys
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock
+
+
+class LRUCache(object):
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def key(self, content, **options):
+        digest = sha1(content.encode("utf-8")).hexdigest()
+        return digest, tuple(sorted(options.items()))
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, size=None):
+        if size is None:
+            size = sys.getsizeof(value)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[1]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.bytes += size
+            self._evict()
+
+    def resize(self, max_entries=None, max_bytes=None):
+        with self.lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self):
+        while self.entries and (len(self.entries) > self.max_entries
+                                or self.bytes > self.max_bytes):
+            _, entry = self.entries.popitem(last=False)
+            self.bytes -= entry[1]
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+            }
+
+    def __len__(self):
+        return len(self.entries)
+
+
+html_cache = LRUCache()
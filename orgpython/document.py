@@ -10,11 +10,17 @@
 # Description:
 # ********************************************************************************
 import re
-from hashlib import sha1
+import string
+from bisect import bisect_left, bisect_right
+from hashlib import blake2b, sha1
+from itertools import chain
 from textwrap import dedent
 
-from .inline import Blankline, Hr, InlineText
+from .export import EXPORTERS
+from .inline import TRIGGER_REGEXP, Blankline, Hr, InlineText, html_escape
 from .src import highlight as src_highlight
+from .src import highlight_many as src_highlight_many
+from .visitor import walk_nodes
 
 DRAWER_BEGIN_REGEXP = re.compile(r"^(\s*):(\S+):\s*$")
 DRAWER_END_REGEXP = re.compile(r"^(\s*):END:\s*$")
@@ -32,6 +38,8 @@ TABLE_ALIGN_REGEXP = re.compile(r"^<(l|c|r)>$")
 LIST_DESCRIPTIVE_REGEXP = re.compile(r"^(\s*)([+*-])\s+(.*)::(\s|$)")
 LIST_UNORDER_REGEXP = re.compile(r"^(\s*)([+*-])(\s+(.*)|$)")
 LIST_ORDER_REGEXP = re.compile(r"^(\s*)(([0-9]+|[a-zA-Z])[.)])(\s+(.*)|$)")
+LIST_REGEXP = re.compile(
+    r"^(\s*)(?:([+*-])|([0-9]+|[a-zA-Z])[.)])(\s+(.*)|$)")
 LIST_STATUS_REGEXP = re.compile(r"\[( |X|-)\]\s")
 LIST_LEVEL_REGEXP = re.compile(r"(\s*)(.+)$")
 
@@ -43,6 +51,28 @@ ATTRIBUTE_REGEXP = re.compile(r"(?:^|\s+)(:[-\w]+)\s+(.*)$")
 
 TODO_KEYWORDS = ("DONE", "TODO")
 
+HEADLINE_ID_HASHES = {
+    "sha1": lambda title: sha1(title).hexdigest()[:10],
+    "blake2b": lambda title: blake2b(title, digest_size=5).hexdigest(),
+}
+
+# first non-blank characters a node can start with, nodes not listed here
+# are tried on every line
+BLOCK_TRIGGERS = {
+    "blankline": "",
+    "headline": "*",
+    "table": "|",
+    "tablerow": "|",
+    "list": "+*-" + string.digits + string.ascii_letters,
+    "drawer": ":",
+    "block": "#",
+    "block_result": "#",
+    "keyword": "#",
+    "hr": "-",
+}
+# nodes that only match at the beginning of a line
+BLOCK_UNINDENTED = ("headline", )
+
 
 def string_split(s, sep):
     if not s:
@@ -50,83 +80,191 @@ def string_split(s, sep):
     return s.split(sep)
 
 
+class EndIndex(object):
+    def __init__(self, lines):
+        self.lines = lines
+        self.markers = {}
+
+    def find(self, node, index, stop):
+        family, name = node.endkey()
+        markers = self.markers.get(family)
+        if markers is None:
+            markers = node.endmarkers(self.lines)
+            self.markers[family] = markers
+
+        positions = markers.get(name, ())
+        i = bisect_left(positions, index)
+        if i == len(positions) or positions[i] >= stop:
+            return -1
+        return positions[i]
+
+
+class TreeBuilder(object):
+    __slots__ = ("frames", )
+
+    _node_types = {}
+
+    # a frame is (node, mode, stars, level, item, only): the stars of the
+    # nearest headline and the indent of the nearest list above the node,
+    # whether the node is inside an item of that list, and the only type
+    # a paragraph or table accepts. Nested headlines have more stars and
+    # nested lists more indent, so the nearest ones are enough
+
+    def __init__(self, root):
+        self.frames = [(root, "parser", None, None, False, None)]
+        node = root
+        while node.children and self.push(node.children[-1]):
+            node = node.children[-1]
+
+    @classmethod
+    def node_type(cls, node_class):
+        node_type = cls._node_types.get(node_class)
+        if node_type is not None:
+            return node_type
+
+        kind = object
+        for base in (Headline, List, Paragraph, Table, Properties, Blankline,
+                     InlineText):
+            if issubclass(node_class, base):
+                kind = base
+                break
+        add_child = getattr(node_class, "add_child", None)
+        if add_child is Parser.add_child:
+            mode = "parser"
+        elif add_child is List.add_child:
+            mode = "list"
+        else:
+            mode = "leaf"
+        return cls._node_types.setdefault(node_class, (kind, mode))
+
+    def push(self, node):
+        _, mode, stars, level, item, only = self.frames[-1]
+        node_type = self._node_types.get(type(node))
+        if node_type is None:
+            node_type = self.node_type(type(node))
+        kind, node_mode = node_type
+        if mode == "list":
+            item = True
+        elif mode != "parser":
+            return False
+        elif kind is Headline:
+            stars = node.stars
+        elif kind is List:
+            level, item = node.level, False
+        elif kind is Paragraph:
+            only = InlineText
+        elif kind is Table:
+            only = Table
+        else:
+            return False
+        self.frames.append((node, node_mode, stars, level, item, only))
+        return True
+
+    def add_child(self, node):
+        frames = self.frames
+        node_type = self._node_types.get(type(node))
+        if node_type is None:
+            node_type = self.node_type(type(node))
+        kind = node_type[0]
+        index = len(frames) - 1
+        while index > 0:
+            _, _, stars, level, item, only = frames[index]
+            if only is None or kind is only:
+                if kind is Blankline:
+                    break
+                if level is None or node.level > level or (
+                        node.level == level and kind is List and not item):
+                    if kind is Properties:
+                        if stars is None:
+                            break
+                    elif kind is not Headline or stars is None:
+                        break
+                    elif node.stars > stars:
+                        break
+            index -= 1
+
+        parent, mode = frames[index][:2]
+        if mode == "leaf":
+            parent.add_child(node)
+            return
+        if mode == "list":
+            parent.add_child(node)
+            child = parent.children[-1]
+        else:
+            last = parent.children[-1] if parent.children else None
+            if isinstance(last, Headline) and kind is Properties:
+                last.properties = node
+                return
+            if isinstance(last, Keyword) and kind is Table:
+                node.keyword = last
+            child = node
+            if kind is InlineText:
+                child = parent.paragraph(node)
+            parent.children.append(child)
+
+        del frames[index + 1:]
+        while self.push(child) and child.children:
+            child = child.children[-1]
+
+
 class Parser(object):
+    __slots__ = (
+        "lines",
+        "level",
+        "children",
+        "inline_engine",
+        "_endindex",
+        "_stop",
+        "_builder",
+    )
+
+    _dispatch_tables = {}
+
+    element = ""
+    escape = True
+    needparse = True
+    parsed_nodes = (
+        "blankline",
+        "headline",
+        "table",
+        "list",
+        "drawer",
+        "block",
+        "block_result",
+        "keyword",
+        "hr",
+    )
+
     def __init__(self, content=""):
-        self.lines = content.splitlines()
+        self.lines = content.splitlines() if content else ()
         self.level = 0
-        self.element = ""
         self.children = []
-        self.escape = True
-        self.needparse = True
-        self.parsed_nodes = (
-            "blankline",
-            "headline",
-            "table",
-            "list",
-            "drawer",
-            "block",
-            "block_result",
-            "keyword",
-            "hr",
-        )
+        self.inline_engine = "default"
+        self._endindex = None
+        self._stop = None
+        self._builder = None
 
     def first_child(self):
         if len(self.children) == 0:
             return
         return self.children[0]
 
+    def walk(self, inline=False):
+        return walk_nodes((self, ), 0, inline)
+
     def last_child(self):
         if len(self.children) == 0:
             return
         return self.children[-1]
 
     def add_child(self, node):
-        last = self.last_child()
-        if self.is_headline(last):
-            if self.is_properties(node):
-                last.properties = node
-                return
-
-            if not self.is_headline(node):
-                last.add_child(node)
-                return
-
-            if self.is_headline(node) and node.stars > last.stars:
-                last.add_child(node)
-                return
-
-        if self.is_table(last):
-            if self.is_table(node):
-                last.add_child(node)
-                return
-
-        if self.is_list(last):
-            if self.is_blankline(node):
-                last.add_child(node)
-                return
-
-            if node.level > last.level:
-                last.add_child(node)
-                return
-
-            if self.is_list(node) and node.level == last.level:
-                last.add_child(node)
-                return
-
-        if self.is_keyword(last):
-            if self.is_table(node):
-                node.keyword = last
-
-        if self.is_paragraph(last):
-            if self.is_inlinetext(node):
-                last.add_child(node)
-                return
-
-        if self.is_inlinetext(node):
-            self.children.append(self.paragraph(node))
-            return
-
-        self.children.append(node)
+        builder = self._builder
+        if builder is None:
+            builder = TreeBuilder(self)
+            # kept while preparse adds nodes, nothing else changes the tree
+            if self._stop is not None:
+                self._builder = builder
+        builder.add_child(node)
 
     def is_keyword(self, child):
         return child and isinstance(child, Keyword)
@@ -156,39 +294,74 @@ class Parser(object):
         return child and isinstance(child, Properties)
 
     def inlinetext(self, text):
-        return InlineText(text, self.needparse, self.escape)
+        return InlineText(
+            text,
+            self.needparse,
+            self.escape,
+            self.inline_engine,
+        )
+
+    def set_inline_engine(self, engine):
+        self.inline_engine = engine
+        for child in self.children:
+            child.set_inline_engine(engine)
 
     def paragraph(self, node):
         n = Paragraph()
         n.add_child(node)
         return n
 
+    def endindex(self, lines):
+        if self._endindex is None or self._endindex.lines is not lines:
+            self._endindex = EndIndex(lines)
+        return self._endindex
+
+    def endkey(self):
+        return self.__class__, None
+
+    def endmarkers(self, lines):
+        positions = []
+        for num in range(len(lines)):
+            if self.matchend(num, lines):
+                positions.append(num)
+        return {None: positions}
+
+    def _parse_stop(self, lines):
+        if self._stop is None:
+            return len(lines)
+        return self._stop
+
+    def _preparse_child(self, node, lines, start, stop):
+        node._endindex = self.endindex(lines)
+        node.preparse(lines, start, stop)
+
     def _parse_paired(self, cls, index, lines):
         node = cls.match(lines[index])
         if not node:
             return None, index
 
-        end = len(lines)
-        num = index + 1
-        while num < end:
-            if node.matchend(num, lines):
-                node.preparse(lines[index + 1:num])
-                return node, num
-            num += 1
-        return None, index
+        num = self.endindex(lines).find(
+            node,
+            index + 1,
+            self._parse_stop(lines),
+        )
+        if num < 0:
+            return None, index
+        self._preparse_child(node, lines, index + 1, num)
+        return node, num
 
     def _parse_nopaired(self, cls, index, lines):
         node = cls.match(lines[index])
         if not node:
             return None, index
 
-        end = len(lines)
+        end = self._parse_stop(lines)
         num = index + 1
         while num < end:
             if node.matchend(num, lines):
                 break
             num += 1
-        node.preparse(lines[index + 1:num])
+        self._preparse_child(node, lines, index + 1, num)
         return node, num
 
     def parse_headline(self, index, lines):
@@ -221,27 +394,62 @@ class Parser(object):
     def parse_inlinetext(self, index, lines):
         return self.inlinetext(lines[index]), index
 
-    def parse(self, index, lines):
+    def dispatch(self, line):
+        key = (self.__class__, self.parsed_nodes)
+        table = self._dispatch_tables.get(key)
+        if table is None:
+            table = self._dispatch_tables.setdefault(key, {})
+
+        stripped = line.lstrip()
+        char = stripped[:1]
+        indented = len(stripped) != len(line)
+        funcs = table.get((char, indented))
+        if funcs is not None:
+            return funcs
+
+        funcs = []
         for b in self.parsed_nodes:
-            func = "parse_" + b
-            if not hasattr(self, func):
+            func = getattr(self.__class__, "parse_" + b, None)
+            if func is None:
                 continue
-            block, num = getattr(self, func)(index, lines)
+            if b in BLOCK_TRIGGERS:
+                triggers = BLOCK_TRIGGERS[b]
+                if not char and triggers:
+                    continue
+                if char and char not in triggers:
+                    continue
+                if indented and b in BLOCK_UNINDENTED:
+                    continue
+            funcs.append(func)
+        funcs = table.setdefault((char, indented), tuple(funcs))
+        return funcs
+
+    def parse(self, index, lines):
+        for func in self.dispatch(lines[index]):
+            block, num = func(self, index, lines)
             if not block:
                 continue
             return block, num
 
         return self.parse_inlinetext(index, lines)
 
-    def preparse(self, lines):
-        index = 0
-        while index < len(lines):
+    def preparse(self, lines, start=0, stop=None):
+        if stop is None:
+            stop = len(lines)
+        self._stop = stop
+        self._builder = None
+
+        index = start
+        while index < stop:
             line = lines[index]
             node, index = self.parse(index, lines)
             if node:
                 node.level = len(line) - len(line.strip())
                 self.add_child(node)
             index += 1
+        self._endindex = None
+        self._stop = None
+        self._builder = None
 
     def to_html(self):
         if len(self.children) == 0 and len(self.lines) > 0:
@@ -258,6 +466,30 @@ class Parser(object):
             return self.element.format(text)
         return text
 
+    def iter_html(self):
+        if len(self.children) == 0 and len(self.lines) > 0:
+            self.preparse(self.lines)
+
+        head, _, tail = self.element.partition("{0}")
+        if head:
+            yield head
+        yield from self.iter_children_html(self.children)
+        if tail:
+            yield tail
+
+    def iter_children_html(self, children):
+        sep = False
+        for child in children:
+            started = False
+            for chunk in child.iter_html():
+                if not chunk:
+                    continue
+                if not started and sep:
+                    yield "\n"
+                started = True
+                yield chunk
+            sep = sep or started
+
     def __str__(self):
         str_children = [str(child) for child in self.children]
         return self.__class__.__name__ + '(' + ','.join(str_children) + ')'
@@ -267,6 +499,19 @@ class Parser(object):
 
 
 class Headline(Parser):
+    __slots__ = (
+        "title",
+        "stars",
+        "keyword",
+        "priority",
+        "tags",
+        "properties",
+        "todo_keywords",
+        "id_hash",
+        "_id",
+        "_toc",
+    )
+
     def __init__(
             self,
             title,
@@ -283,6 +528,9 @@ class Headline(Parser):
         self.tags = tags
         self.properties = None
         self.todo_keywords = todo_keywords
+        self.id_hash = "sha1"
+        self._id = None
+        self._toc = None
 
     @classmethod
     def match(cls, line):
@@ -311,12 +559,22 @@ class Headline(Parser):
         )
 
     def id(self):
-        hid = 'org-{0}'.format(sha1(self.title.encode()).hexdigest()[:10])
+        if self._id is not None:
+            return self._id
+
+        title = self.title.encode()
+        hid = 'org-{0}'.format(HEADLINE_ID_HASHES[self.id_hash](title))
         if self.properties:
-            return self.properties.get("CUSTOM_ID", hid)
+            hid = self.properties.get("CUSTOM_ID", hid)
+        self._id = hid
         return hid
 
     def toc(self):
+        if self._toc is None:
+            self._toc = self._render_toc()
+        return self._toc
+
+    def _render_toc(self):
         b = ""
         if self.keyword:
             b = b + "<span class=\"todo\">{0}</span>".format(self.keyword)
@@ -337,8 +595,18 @@ class Headline(Parser):
         )
         return b + super(Headline, self).to_html()
 
+    def iter_html(self):
+        yield "<h{0} id=\"{1}\">{2}</h{0}>".format(
+            self.stars,
+            self.id(),
+            self.toc(),
+        )
+        yield from super(Headline, self).iter_html()
+
 
 class Drawer(Parser):
+    __slots__ = ("name", )
+
     def __init__(self, name):
         super(Drawer, self).__init__()
         self.name = name
@@ -356,11 +624,22 @@ class Drawer(Parser):
     def matchend(self, index, lines):
         return DRAWER_END_REGEXP.match(lines[index])
 
+    def endkey(self):
+        # drawers share one scan unless a subclass decides its own end
+        if type(self).matchend is not Drawer.matchend:
+            return (self.__class__, self.name), None
+        return Drawer, None
+
     def to_html(self):
         return ""
 
+    def iter_html(self):
+        yield self.to_html()
+
 
 class Properties(Drawer):
+    __slots__ = ("properties", )
+
     def __init__(self, name):
         super(Properties, self).__init__(name)
         self.properties = {}
@@ -379,6 +658,8 @@ class Properties(Drawer):
 
 
 class Block(Parser):
+    __slots__ = ("name", "params")
+
     def __init__(self, name, params=""):
         super(Block, self).__init__()
         self.name = name
@@ -409,17 +690,39 @@ class Block(Parser):
         match = BLOCK_END_REGEXP.match(lines[index])
         return match and match[2].lower() == self.name
 
+    def endkey(self):
+        # blocks share one scan unless a subclass decides its own end
+        if type(self).matchend is not Block.matchend:
+            return (self.__class__, self.name), None
+        return Block, self.name
+
+    def endmarkers(self, lines):
+        if type(self).matchend is not Block.matchend:
+            return super(Block, self).endmarkers(lines)
+        markers = {}
+        for num, line in enumerate(lines):
+            match = BLOCK_END_REGEXP.match(line)
+            if match:
+                markers.setdefault(match[2].lower(), []).append(num)
+        return markers
+
 
 class Center(Block):
+    __slots__ = ()
+
+    element = "<div style=\"text-align: center;\">\n{0}\n</div>"
+
     def __init__(self, params=""):
         super(Center, self).__init__("center", params)
-        self.element = "<div style=\"text-align: center;\">\n{0}\n</div>"
 
 
 class Verse(Block):
+    __slots__ = ()
+
+    element = "<p class=\"verse\">\n{0}\n</p>"
+
     def __init__(self, params=""):
         super(Verse, self).__init__("verse", params)
-        self.element = "<p class=\"verse\">\n{0}\n</p>"
 
     def add_child(self, node):
         self.children.append(node)
@@ -428,61 +731,93 @@ class Verse(Block):
         children = [child.to_html() for child in self.children]
         return self.element.format("<br />".join(children))
 
+    def iter_html(self):
+        yield self.to_html()
+
 
 class Quote(Block):
+    __slots__ = ()
+
+    element = "<blockquote>\n{0}\n</blockquote>"
+
     def __init__(self, params=""):
         super(Quote, self).__init__("quote", params)
-        self.element = "<blockquote>\n{0}\n</blockquote>"
 
 
 class Export(Block):
+    __slots__ = ("language", )
+
+    parsed_nodes = ()
+
     def __init__(self, language="", params=""):
         super(Export, self).__init__("export", params)
         self.language = language
-        self.escape = self.language.upper() != "HTML"
-        self.parsed_nodes = ()
+
+    @property
+    def escape(self):
+        return self.language.upper() != "HTML"
 
     def to_html(self):
         if not self.escape:
             return super(Export, self).to_html()
         return ""
 
+    def iter_html(self):
+        if not self.escape:
+            return super(Export, self).iter_html()
+        return iter(())
+
 
 class Src(Block):
+    __slots__ = ("language", "highlight_code", "guess_lexer", "highlighted")
+
+    element = "<pre class=\"src src-{0}\">\n{1}\n</pre>"
+    escape = False
+    needparse = False
+    parsed_nodes = ()
+
     def __init__(self, language="", params="", highlight=False):
         super(Src, self).__init__("src", params)
         self.language = language
         self.highlight_code = highlight
-        self.element = "<pre class=\"src src-{0}\">\n{1}\n</pre>"
-        self.needparse = False
-        self.escape = False
-        self.parsed_nodes = ()
+        self.guess_lexer = True
+        self.highlighted = None
 
     def add_child(self, node):
         self.children.append(node)
 
     def highlight(self, language, text):
-        return src_highlight(language, text)
+        return src_highlight(language, text, self.guess_lexer)
+
+    def code(self):
+        return dedent("\n".join([child.to_html() for child in self.children]))
 
     def to_html(self):
-        text = "\n".join([child.to_html() for child in self.children])
+        if self.highlight_code and self.highlighted is not None:
+            return self.highlighted
+        text = self.code()
         if self.highlight_code:
-            return self.highlight(self.language, dedent(text))
+            return self.highlight(self.language, text)
         if not self.language:
-            return "<pre>\n{0}\n</pre>".format(dedent(text))
-        return self.element.format(self.language, dedent(text))
+            return "<pre>\n{0}\n</pre>".format(text)
+        return self.element.format(self.language, text)
+
+    def iter_html(self):
+        yield self.to_html()
 
 
 class Example(Src):
+    __slots__ = ()
+
     def __init__(self, params="", highlight=False):
         super(Example, self).__init__("example", params, highlight)
         self.name = "example"
 
 
 class BlockResult(Parser):
-    def __init__(self):
-        super(BlockResult, self).__init__()
-        self.element = "<pre class=\"example\">\n{0}\n</pre>"
+    __slots__ = ()
+
+    element = "<pre class=\"example\">\n{0}\n</pre>"
 
     @classmethod
     def match(cls, line):
@@ -500,11 +835,14 @@ class BlockResult(Parser):
 
 
 class ListItem(Parser):
+    __slots__ = ("status", "checkbox")
+
+    element = "<li>\n{0}\n</li>"
+
     def __init__(self, status=None, checkbox="HTML"):
         super(ListItem, self).__init__()
         self.status = status
         self.checkbox = checkbox
-        self.element = "<li>\n{0}\n</li>"
 
     @classmethod
     def match(cls, line):
@@ -515,7 +853,9 @@ class ListItem(Parser):
             status, content = status_match[1], content[len("[ ] "):]
 
         node = cls(status)
-        node.add_child(node.inlinetext(content))
+        node.children.append(node.paragraph(node.inlinetext(content)))
+        if status is not None:
+            node.set_status()
         return node
 
     def set_status(self):
@@ -539,47 +879,58 @@ class ListItem(Parser):
 
         self.children[0].children = [node] + self.children[0].children
 
-    def to_html(self):
-        if self.status is not None:
-            self.set_status()
-        return super(ListItem, self).to_html()
-
 
 class DescriptiveItem(ListItem):
+    __slots__ = ()
+
+    element = "<dt>\n{0}\n</dt>"
+
     def __init__(self, title="", status=""):
         super(DescriptiveItem, self).__init__(title, status)
-        self.element = "<dt>\n{0}\n</dt>"
 
 
 class List(Parser):
-    def __init__(self, items=[]):
+    __slots__ = ()
+
+    def __init__(self, items=None):
         super(List, self).__init__()
-        self.children = items
+        if items is not None:
+            self.children = items
 
     @classmethod
     def match(cls, line):
-        match = UnorderList.match(line)
-        if match:
-            return match
+        match = LIST_REGEXP.match(line)
+        if not match:
+            return
+        return cls.from_match(match)
 
-        match = OrderList.match(line)
-        if match:
-            return match
+    @classmethod
+    def from_match(cls, match):
+        if match[2]:
+            return UnorderList([cls.item(match)])
+        return OrderList([cls.item(match)])
 
-        return Descriptive.match(line)
+    @classmethod
+    def item(cls, match):
+        if match[2]:
+            return ListItem.match(match[5] or "")
+        return ListItem.match(match[4])
 
     def add_child(self, node):
         if self.is_list(node) and node.level == self.level:
-            self.children.append(node.children[0])
+            self.children.extend(node.children)
             return
         last = self.last_child()
         last.add_child(node)
 
 
 class Descriptive(List):
-    def __init__(self, items=[]):
+    __slots__ = ()
+
+    element = "<dd>\n{0}\n</dd>"
+
+    def __init__(self, items=None):
         super(Descriptive, self).__init__(items)
-        self.element = "<dd>\n{0}\n</dd>"
 
     @classmethod
     def match(cls, line):
@@ -591,9 +942,12 @@ class Descriptive(List):
 
 
 class UnorderList(List):
-    def __init__(self, items=[]):
+    __slots__ = ()
+
+    element = "<ul>\n{0}\n</ul>"
+
+    def __init__(self, items=None):
         super(UnorderList, self).__init__(items)
-        self.element = "<ul>\n{0}\n</ul>"
 
     @classmethod
     def match(cls, line):
@@ -605,9 +959,12 @@ class UnorderList(List):
 
 
 class OrderList(List):
-    def __init__(self, items=[]):
+    __slots__ = ()
+
+    element = "<ol>\n{0}\n</ol>"
+
+    def __init__(self, items=None):
         super(OrderList, self).__init__(items)
-        self.element = "<ol>\n{0}\n</ol>"
 
     @classmethod
     def match(cls, line):
@@ -618,11 +975,66 @@ class OrderList(List):
         return cls([title])
 
 
+class ListBuilder(object):
+    __slots__ = ("stack", )
+
+    # every open list, innermost last. The open item of a list is its last
+    # child, and nested lists always have more indent than their parents
+
+    def __init__(self):
+        self.stack = []
+
+    def add_line(self, match):
+        stack = self.stack
+        indent = len(match[1])
+        while stack and stack[-1].level > indent:
+            stack.pop()
+        if not stack:
+            return False
+
+        parent = stack[-1]
+        if parent.level == indent:
+            parent.children.append(List.item(match))
+            return True
+        node = List.from_match(match)
+        node.level = indent
+        parent.children[-1].children.append(node)
+        stack.append(node)
+        return True
+
+    def parse(self, index, lines, stop):
+        match = LIST_REGEXP.match(lines[index])
+        if not match:
+            return None, index
+
+        node = List.from_match(match)
+        node.level = len(match[1])
+        self.stack = [node]
+        while index + 1 < stop:
+            match = LIST_REGEXP.match(lines[index + 1])
+            if not match or match[2] == "*" and not match[1]:
+                break
+            if not self.add_line(match):
+                break
+            index += 1
+        self.stack = []
+        return node, index
+
+
 class TableColumn(Parser):
+    __slots__ = ("header", )
+
+    parsed_nodes = ()
+
     def __init__(self, content="", header=False):
-        super(TableColumn, self).__init__(content)
+        super(TableColumn, self).__init__()
         self.header = header
-        self.parsed_nodes = ()
+        if content:
+            self.add_child(self.inlinetext(content))
+
+    @property
+    def element(self):
+        return "<th>{0}</th>" if self.header else "<td>{0}</td>"
 
     def add_child(self, child):
         self.children.append(child)
@@ -630,18 +1042,17 @@ class TableColumn(Parser):
     def reset(self):
         self.header = True
 
-    def to_html(self):
-        self.element = "<th>{0}</th>" if self.header else "<td>{0}</td>"
-        return super(TableColumn, self).to_html()
-
 
 class TableRow(Parser):
+    __slots__ = ("is_sep", "header")
+
+    element = "<tr>\n{0}\n</tr>"
+    parsed_nodes = ("tablecolumn", )
+
     def __init__(self, header=False):
         super(TableRow, self).__init__()
         self.is_sep = False
         self.header = header
-        self.element = "<tr>\n{0}\n</tr>"
-        self.parsed_nodes = ("tablecolumn", )
 
     @classmethod
     def match(cls, line):
@@ -667,11 +1078,14 @@ class TableRow(Parser):
 
 
 class Table(Parser):
+    __slots__ = ("keyword", )
+
+    element = "<table>\n{0}\n</table>"
+    parsed_nodes = ("tablerow", )
+
     def __init__(self, keyword=None):
         super(Table, self).__init__()
-        self.element = "<table>\n{0}\n</table>"
         self.keyword = keyword
-        self.parsed_nodes = ("tablerow", )
 
     @classmethod
     def match(cls, line):
@@ -704,7 +1118,87 @@ class Table(Parser):
         return TableRow.match(lines[index]), index
 
 
+class FastTable(Table):
+    __slots__ = ("rows", "header_rows", "aligns")
+
+    aligns_style = {
+        "l": "left",
+        "c": "center",
+        "r": "right",
+    }
+
+    def __init__(self, keyword=None):
+        super(FastTable, self).__init__(keyword)
+        self.rows = []
+        self.header_rows = 0
+        self.aligns = {}
+
+    @classmethod
+    def match(cls, line):
+        if not TABLE_ROW_REGEXP.match(line):
+            return
+        table = cls()
+        table.add_row(line)
+        return table
+
+    def add_row(self, line):
+        if TABLE_SEP_REGEXP.match(line):
+            if not self.header_rows:
+                self.header_rows = len(self.rows)
+            return
+
+        match = TABLE_ROW_REGEXP.match(line)
+        cells = [cell.strip() for cell in match[2].strip("|").split("|")]
+        aligns = {}
+        for num, cell in enumerate(cells):
+            if not cell:
+                continue
+            align = TABLE_ALIGN_REGEXP.match(cell)
+            if not align:
+                self.rows.append(cells)
+                return
+            aligns[num] = self.aligns_style[align[1]]
+        if not aligns:
+            self.rows.append(cells)
+            return
+        self.aligns.update(aligns)
+
+    def preparse(self, lines, start=0, stop=None):
+        if stop is None:
+            stop = len(lines)
+        for index in range(start, stop):
+            self.add_row(lines[index])
+
+    def row_html(self, cells, header):
+        tag = "th" if header else "td"
+        columns = []
+        for num, cell in enumerate(cells):
+            align = self.aligns.get(num)
+            if align:
+                head = "<{0} style=\"text-align: {1};\">".format(tag, align)
+            else:
+                head = "<{0}>".format(tag)
+            if TRIGGER_REGEXP.search(cell):
+                text = self.inlinetext(cell).to_html()
+            else:
+                text = html_escape(cell)
+            columns.append("{0}{1}</{2}>".format(head, text, tag))
+        return "<tr>\n{0}\n</tr>".format("\n".join(columns))
+
+    def to_html(self):
+        rows = [
+            self.row_html(cells, num < self.header_rows)
+            for num, cells in enumerate(self.rows)
+        ]
+        return self.element.format("\n".join(rows))
+
+    def iter_html(self):
+        yield self.to_html()
+
+
 class Keyword(Parser):
+    __slots__ = ("key", "value")
+
     def __init__(self, key, value=""):
         super(Keyword, self).__init__()
         self.key = key
@@ -744,18 +1238,23 @@ class Keyword(Parser):
     def to_html(self):
         return ""
 
+    def iter_html(self):
+        yield self.to_html()
+
 
 class Paragraph(Parser):
-    def __init__(self, content=""):
-        super(Paragraph, self).__init__(content)
-        self.element = "<p>\n{0}\n</p>"
-        self.parsed_nodes = ()
+    __slots__ = ()
+
+    element = "<p>\n{0}\n</p>"
+    parsed_nodes = ()
 
     def add_child(self, node):
         self.children.append(node)
 
 
 class Section(Parser):
+    __slots__ = ("headline", )
+
     def __init__(self, headline):
         super(Section, self).__init__()
         self.headline = headline
@@ -788,46 +1287,212 @@ class Section(Parser):
             "\n".join([child.to_html() for child in self.children]))
         return text
 
+    def iter_html(self):
+        yield self.to_html()
+
 
 class Toc(Parser):
+    __slots__ = ("sections", )
+
+    element = (
+        '<div id="table-of-contents">'
+        '<h2>Table of Contents</h2>'
+        '<div id="text-table-of-contents">'
+        '\n<ul>\n{0}\n</ul>\n</div></div>')
+
     def __init__(self):
         super(Toc, self).__init__()
-        self.element = (
-            '<div id="table-of-contents">'
-            '<h2>Table of Contents</h2>'
-            '<div id="text-table-of-contents">'
-            '\n<ul>\n{0}\n</ul>\n</div></div>')
+        self.sections = []
 
     def add_child(self, node):
-        last = self.last_child()
-        if not last:
+        # sections below the last top level one have increasing stars,
+        # so the parent of a new section is found from the bottom
+        sections = self.sections
+        if not sections or node.stars == sections[0].stars:
             self.children.append(node)
+            self.sections = [node]
             return
 
-        if node.stars > last.stars:
-            last.add_child(node)
-            return
-
-        if node.stars < last.stars:
-            last.add_child(node)
-            return
-
-        self.children.append(node)
+        while len(sections) > 1 and node.stars <= sections[-1].stars:
+            sections.pop()
+        sections[-1].children.append(node)
+        sections.append(node)
 
     def to_html(self):
         if not self.children:
             return ""
         return super(Toc, self).to_html()
 
+    def iter_html(self):
+        if not self.children:
+            return iter(())
+        return super(Toc, self).iter_html()
+
+
+class Probe(object):
+    _probe_classes = {}
+
+    @classmethod
+    def probe_class(cls, document_class):
+        key = cls, document_class
+        probe = cls._probe_classes.get(key)
+        if probe is None:
+            probe = type(
+                document_class.__name__ + cls.__name__,
+                (cls, document_class),
+                {},
+            )
+            probe = cls._probe_classes.setdefault(key, probe)
+        return probe
+
+
+class StreamProbe(Probe):
+    def __init__(self, *args, **kwargs):
+        super(StreamProbe, self).__init__(*args, **kwargs)
+        self.incomplete = None
+
+    def add_child(self, node):
+        pass
+
+    def _preparse_child(self, node, lines, start, stop):
+        pass
+
+    def _parse_paired(self, cls, index, lines):
+        node, num = super(StreamProbe, self)._parse_paired(cls, index, lines)
+        if node or self.incomplete is not None:
+            return node, num
+        if cls.match(lines[index]):
+            self.incomplete = index
+        return node, num
+
+    def _parse_nopaired(self, cls, index, lines):
+        node, num = super(StreamProbe, self)._parse_nopaired(
+            cls, index, lines)
+        if not node or self.incomplete is not None:
+            return node, num
+        if num >= self._parse_stop(lines):
+            self.incomplete = index
+        return node, num
+
+
+class SectionProbe(Probe):
+    parse_children = False
+
+    def __init__(self, *args, **kwargs):
+        super(SectionProbe, self).__init__(*args, **kwargs)
+        self.sections = [(0, 0, {}, {})]
+        self._headline = None
+
+    def _preparse_child(self, node, lines, start, stop):
+        # headline ids depend on CUSTOM_ID, everything else is parsed again
+        # by the workers
+        if self.parse_children or self.is_properties(node):
+            super(SectionProbe, self)._preparse_child(node, lines, start, stop)
+
+    def parse_headline(self, index, lines):
+        self._headline = index
+        return super(SectionProbe, self).parse_headline(index, lines)
+
+    def add_child(self, node):
+        count = len(self.children)
+        super(SectionProbe, self).add_child(node)
+        if len(self.children) > count and self.is_headline(node):
+            self.sections.append((
+                self._headline,
+                count,
+                dict(self.properties),
+                dict(self.options),
+            ))
+
+
+class SectionParser(SectionProbe):
+    parse_children = True
+
+    def __init__(self, *args, **kwargs):
+        super(SectionParser, self).__init__(*args, **kwargs)
+        self.headlines = []
+        self.opened = []
+
+    def parse_headline(self, index, lines):
+        block, index = super(SectionParser, self).parse_headline(index, lines)
+        if block:
+            self.headlines.append((index, block))
+        return block, index
+
+    def _parse_paired(self, cls, index, lines):
+        node, num = super(SectionParser, self)._parse_paired(
+            cls, index, lines)
+        if not node and cls.match(lines[index]):
+            self.opened.append(index)
+        return node, num
+
+
+class ParsedSection(object):
+    __slots__ = (
+        "start",
+        "properties",
+        "options",
+        "children",
+        "headlines",
+        "opened",
+        "html",
+    )
+
+    def __init__(self, start, properties, options):
+        self.start = start
+        self.properties = properties
+        self.options = options
+        self.children = []
+        self.headlines = []
+        self.opened = False
+        self.html = None
+
+    def to_html(self):
+        if self.html is None:
+            children = []
+            for child in self.children:
+                content = child.to_html()
+                if content:
+                    children.append(content)
+            self.html = "\n".join(children)
+        return self.html
+
 
 class Document(Parser):
-    def __init__(self, content, offset=0, highlight=False, **options):
+    def __init__(
+            self,
+            content,
+            offset=0,
+            highlight=False,
+            inline_engine="default",
+            guess_lexer=True,
+            highlight_executor=None,
+            headline_id="sha1",
+            table_engine="default",
+            list_engine="default",
+            **options):
         super(Document, self).__init__(content)
         self.offset = offset
         self.highlight = highlight
+        self.inline_engine = inline_engine
+        self.guess_lexer = guess_lexer
+        self.highlight_executor = highlight_executor
+        self.headline_id = headline_id
+        self.table_engine = table_engine
+        self.list_engine = list_engine
         self.options = options
+        self.initial_options = dict(options)
         self.properties = {}
         self.toc = Toc()
+        self.stream = None
+        self.stream_toc = None
+        self.parsed_sections = None
+
+    @classmethod
+    def from_stream(cls, lines, **kwargs):
+        document = cls("", **kwargs)
+        document.stream = lines
+        return document
 
     def _is_true(self, value):
         return value in ("true", "t", "1", True, 1)
@@ -853,6 +1518,7 @@ class Document(Parser):
         if not block:
             return block, index
         block.stars = block.stars + self.offset
+        block.id_hash = self.headline_id
 
         todo_keywords = self.properties.get("TODO")
         if todo_keywords:
@@ -864,16 +1530,374 @@ class Document(Parser):
         self.toc.add_child(self.section(block))
         return block, index
 
+    def parse_table(self, index, lines):
+        if self.table_engine == "fast":
+            return self._parse_nopaired(FastTable, index, lines)
+        return super(Document, self).parse_table(index, lines)
+
+    def parse_list(self, index, lines):
+        if self.list_engine == "fast":
+            return ListBuilder().parse(index, lines, self._parse_stop(lines))
+        return super(Document, self).parse_list(index, lines)
+
     def parse_block(self, index, lines):
         block, index = super(Document, self).parse_block(index, lines)
         if not block:
             return block, index
         if self.is_src(block):
             block.highlight_code = self.highlight
+            block.guess_lexer = self.guess_lexer
         return block, index
 
-    def to_html(self):
-        text = super(Document, self).to_html()
+    def preparse(self, lines, start=0, stop=None):
+        super(Document, self).preparse(lines, start, stop)
+        if self.inline_engine != "default":
+            self.set_inline_engine(self.inline_engine)
+
+    def iter_lines(self):
+        for line in self.stream:
+            for s in line.splitlines() or [""]:
+                yield s
+
+    def walk(self, inline=False):
+        yield self, 0, True
+        yield from walk_nodes(self.iter_nodes(), 1, inline)
+        yield self, 0, False
+
+    def iter_nodes(self):
+        if self.stream is None:
+            if len(self.children) == 0 and len(self.lines) > 0:
+                self.preparse(self.lines)
+            yield from self.children
+            return
+
+        lines = []
+        start = retry = 0
+        for line in self.iter_lines():
+            lines.append(line)
+            if len(lines) < max(retry, 2) or not HEADLINE_REGEXP.match(line):
+                continue
+            # lines can only be parsed once nothing in them depends on lines
+            # that are not read yet
+            probe = StreamProbe.probe_class(self.__class__)(
+                "", **self._section_kwargs(self.options))
+            probe.preparse(lines, start)
+            if probe.incomplete is None:
+                yield from self._flush(lines)
+                lines = []
+                start = retry = 0
+            else:
+                start = probe.incomplete
+                retry = len(lines) * 2
+
+        self.stream = None
+        self.preparse(lines)
+        yield from self.children
+
+    def _flush(self, lines):
+        self.preparse(lines)
+        children = self.children[:-1]
+        if not children:
+            return children
+
+        # whether there is a toc is decided once, when the first node is
+        # ready, otherwise headlines are dropped together with their nodes
+        if self.stream_toc is None:
+            self.stream_toc = self._is_true(self.options.get("toc"))
+        if not self.stream_toc:
+            self.toc = Toc()
+        del self.children[:-1]
+        return children
+
+    def to_html(self, parallel=None):
+        if self.stream is not None:
+            return "".join(self.iter_html())
+
+        if parallel and parallel > 1 and not self.children:
+            return self._parallel_html(parallel)
+
+        if self.parsed_sections is not None:
+            text = self._sections_html()
+        else:
+            if len(self.children) == 0 and len(self.lines) > 0:
+                self.preparse(self.lines)
+            self.highlight_blocks()
+            text = super(Document, self).to_html()
+
         if self._is_true(self.options.get("toc")):
             return self.toc.to_html() + "\n" + text
         return text
+
+    def render(self, formats=("html", "text")):
+        exporters = [EXPORTERS[name]() for name in formats]
+        if "html" in formats and self.stream is None:
+            if len(self.children) == 0 and len(self.lines) > 0:
+                self.preparse(self.lines)
+            self.highlight_blocks()
+
+        # as in iter_html, a stream keeps its toc only when that was decided
+        # before its first node was ready
+        streamed = self.stream is not None
+        toc = not streamed
+        inline = any(exporter.inline for exporter in exporters)
+        for node, depth, entering in self.walk(inline):
+            if streamed and depth == 1:
+                toc = self.stream is None or bool(self.stream_toc)
+                streamed = False
+            for exporter in exporters:
+                exporter.event(node, depth, entering)
+
+        results = {}
+        for name, exporter in zip(formats, exporters):
+            results[name] = exporter.result()
+        if "html" in results and toc and self._is_true(
+                self.options.get("toc")):
+            results["html"] = self.toc.to_html() + "\n" + results["html"]
+        return results
+
+    def to_text(self):
+        return self.render(("text", ))["text"]
+
+    def to_markdown(self):
+        return self.render(("markdown", ))["markdown"]
+
+    def highlight_nodes(self, children=None):
+        if children is None:
+            children = self.children
+        nodes = children[::-1]
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node, Src):
+                if node.highlight_code:
+                    yield node
+                continue
+            if isinstance(node, Parser):
+                nodes.extend(node.children[::-1])
+
+    def highlight_blocks(self, children=None):
+        if self.highlight_executor is None or not self.highlight:
+            return
+        nodes = list(self.highlight_nodes(children))
+        blocks = [(node.language, node.code(), node.guess_lexer)
+                  for node in nodes]
+        results = src_highlight_many(blocks, self.highlight_executor)
+        for node, html in zip(nodes, results):
+            node.highlighted = html
+
+    def _section_kwargs(self, options):
+        return dict(
+            options,
+            offset=self.offset,
+            highlight=self.highlight,
+            inline_engine=self.inline_engine,
+            guess_lexer=self.guess_lexer,
+            headline_id=self.headline_id,
+            table_engine=self.table_engine,
+            list_engine=self.list_engine,
+        )
+
+    def update(self, edits):
+        if self.parsed_sections is None:
+            if self.stream is not None:
+                self.lines = list(self.iter_lines())
+                self.stream = None
+            self.lines = list(self.lines)
+            self.parsed_sections = [
+                ParsedSection(0, {}, dict(self.initial_options)),
+            ]
+            self._reparse_sections(0, 0)
+
+        sections = self.parsed_sections
+        first = last = None
+        for start, stop, text in edits:
+            if isinstance(text, str):
+                text = text.splitlines()
+            low, high = self._edited_sections(start, stop)
+            self.lines[start:stop] = text
+            end = start + len(text)
+            for section in sections[low + 1:high + 1]:
+                section.start = end
+            for section in sections[high + 1:]:
+                section.start += end - stop
+            first = low if first is None else min(first, low)
+            last = high if last is None else max(last, high)
+        if first is not None:
+            self._reparse_sections(first, last)
+
+        self.children = []
+        self.toc = Toc()
+        for section in sections:
+            self.children.extend(section.children)
+            for headline in section.headlines:
+                self.toc.add_child(self.section(headline))
+        return self
+
+    def _edited_sections(self, start, stop):
+        sections = self.parsed_sections
+        starts = [section.start for section in sections]
+        first = bisect_right(starts, start) - 1
+        # the first line of a section decides where the previous one ends
+        if first > 0 and starts[first] == start:
+            first -= 1
+        last = max(first, bisect_right(starts, stop - 1) - 1)
+        # an unterminated block may now find its end in the edited lines
+        for index in range(first):
+            if sections[index].opened:
+                return index, last
+        return first, last
+
+    def _reparse_sections(self, first, last):
+        sections = self.parsed_sections
+        lines = self.lines
+        while True:
+            start = sections[first].start
+            if last + 1 < len(sections):
+                stop = sections[last + 1].start
+            else:
+                stop = len(lines)
+            if stop == len(lines):
+                parser, parsed, _ = self._parse_sections(
+                    sections[first], start, stop)
+                self.properties = parser.properties
+                self.options = parser.options
+                break
+            # lines that are parsed without the rest of the document may
+            # fail where the whole document does not
+            try:
+                parser, parsed, boundary = self._parse_sections(
+                    sections[first], start, stop)
+            except Exception:
+                parser = None
+            if parser and self._parsed_before(parser, boundary,
+                                              sections[last + 1]):
+                break
+            last = len(sections) - 1
+        sections[first:last + 1] = parsed
+        if not sections:
+            sections.append(ParsedSection(0, {}, dict(self.initial_options)))
+
+    def _parse_sections(self, first, start, stop):
+        kwargs = self._section_kwargs(first.options)
+        parser = SectionParser.probe_class(self.__class__)("", **kwargs)
+        parser.properties = dict(first.properties)
+        # the headline after the edited lines is parsed as well, to see
+        # whether it still starts a section with the same state
+        size = stop - start
+        parser.preparse(self.lines[start:stop + 1])
+
+        marks = parser.sections
+        marks[0] = (0, 0, first.properties, first.options)
+        boundary = None
+        if len(marks) > 1 and marks[-1][0] == size:
+            boundary = marks.pop()
+        until = boundary[1] if boundary else len(parser.children)
+        marks.append((size, until, None, None))
+
+        parsed = []
+        headlines = iter(parser.headlines)
+        headline = next(headlines, None)
+        for (line, child, properties, options), (end, until, _, _) in zip(
+                marks, marks[1:]):
+            if line == end:
+                continue
+            section = ParsedSection(start + line, properties, options)
+            section.children = parser.children[child:until]
+            while headline and headline[0] < end:
+                section.headlines.append(headline[1])
+                headline = next(headlines, None)
+            section.opened = any(line <= i < end for i in parser.opened)
+            parsed.append(section)
+        return parser, parsed, boundary
+
+    def _parsed_before(self, parser, boundary, section):
+        if boundary is None or parser.opened:
+            return False
+        _, _, properties, options = boundary
+        return properties == section.properties and options == section.options
+
+    def _sections_html(self):
+        children = []
+        for section in self.parsed_sections:
+            if section.html is None:
+                children.extend(section.children)
+        if children:
+            self.highlight_blocks(children)
+
+        sections = []
+        for section in self.parsed_sections:
+            content = section.to_html()
+            if content:
+                sections.append(content)
+        return "\n".join(sections)
+
+    def _parallel_html(self, workers):
+        kwargs = self._section_kwargs(self.options)
+        probe = SectionProbe.probe_class(self.__class__)("", **kwargs)
+        probe.preparse(self.lines)
+
+        lines = self.lines
+        size = max(1, len(lines) // (workers * 4))
+        chunks = []
+        sections = probe.sections + [(len(lines), 0, None, None)]
+        for (start, _, properties, _), (stop, _, _, _) in zip(
+                sections, sections[1:]):
+            if start == stop:
+                continue
+            if chunks and stop - chunks[-1][0] <= size:
+                chunks[-1][1] = stop
+                continue
+            chunks.append([start, stop, properties])
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [
+                executor.submit(
+                    _render_section,
+                    self.__class__,
+                    lines[start:stop],
+                    properties,
+                    kwargs,
+                ) for start, stop, properties in chunks
+            ]
+            children = []
+            for future in futures:
+                children.extend(future.result())
+
+        text = "\n".join(children)
+        if self._is_true(probe.options.get("toc")):
+            return probe.toc.to_html() + "\n" + text
+        return text
+
+    def iter_html(self):
+        if self.stream is not None:
+            nodes = self.iter_nodes()
+            first = next(nodes, None)
+            if first is None:
+                return
+            if self.stream is not None and not self.stream_toc:
+                yield from self.iter_children_html(chain([first], nodes))
+                return
+            self.children = [first] + list(nodes)
+
+        if len(self.children) == 0 and len(self.lines) > 0:
+            self.preparse(self.lines)
+        self.highlight_blocks()
+
+        if self._is_true(self.options.get("toc")):
+            yield from self.toc.iter_html()
+            yield "\n"
+        yield from super(Document, self).iter_html()
+
+
+def _render_section(cls, lines, properties, kwargs):
+    document = cls("", **kwargs)
+    document.properties = properties
+    document.preparse(lines)
+
+    children = []
+    for child in document.children:
+        content = child.to_html()
+        if content:
+            children.append(content)
+    return children
@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ********************************************************************************
+# Copyright © 2017-2020 jianglin
+# File Name: export.py
+# Author: jianglin
+# Email: mail@honmaple.com
+# Created: 2020-08-25 20:41:37 (CST)
+# Last Update:
+#          By:
+# Description:
+# ********************************************************************************
+import re
+from html import unescape
+
+from .visitor import Visitor
+
+MARKDOWN_ESCAPE_REGEXP = re.compile(r"([\\`*_\[\]<>])")
+
+
+class HtmlExporter(Visitor):
+    inline = False
+
+    def __init__(self):
+        self.html = []
+
+    def generic_visit(self, node, depth):
+        if depth != 1:
+            return
+        html = node.to_html()
+        if html:
+            self.html.append(html)
+        return False
+
+    def result(self):
+        return "\n".join(self.html)
+
+
+class TextExporter(Visitor):
+    inline = True
+
+    bullet = "- "
+    quote = ""
+    markers = {}
+    status = {"X": "[X] ", "-": "[-] ", " ": "[ ] "}
+
+    def __init__(self):
+        self.lines = []
+        # prefixes of the open list items and quotes, an item that has
+        # not written its first line yet keeps its bullet in marker
+        self.prefixes = []
+        self.marker = None
+        self.lists = []
+        self.separate = False
+        self.texts = None
+        self.pieces = None
+        self.rows = None
+
+    def result(self):
+        return "\n".join(self.lines)
+
+    def escape(self, text):
+        return text
+
+    def open_block(self):
+        if self.separate and self.lines:
+            self.lines.append("".join(self.prefixes).rstrip())
+        self.separate = False
+
+    def write(self, lines, raw=False):
+        self.open_block()
+        prefix = "".join(self.prefixes)
+        for line in lines:
+            if self.marker is not None:
+                line, self.marker = self.marker + line, None
+            else:
+                line = prefix + line
+            self.lines.append(line if raw else line.rstrip())
+
+    def end_block(self, node=None, depth=None):
+        self.separate = True
+
+    def inline_text(self, node):
+        texts, pieces = self.texts, self.pieces
+        self.texts = []
+        self.run(node, inline=True)
+        text = " ".join(self.texts)
+        self.texts, self.pieces = texts, pieces
+        return text
+
+    def headline(self, node, title):
+        return title
+
+    def code(self, language, lines):
+        return lines
+
+    def table(self, rows, header_rows):
+        return [" | ".join(cells) for cells in rows]
+
+    def link(self, node):
+        desc = node.desc or node.content
+        return self.escape(unescape(desc))
+
+    def footnote(self, node):
+        return "[{0}]".format(unescape(node.content))
+
+    def newline(self, node):
+        return ""
+
+    def visit_headline(self, node, depth):
+        title = self.inline_text(node.inlinetext(node.title))
+        if node.keyword:
+            title = "{0} {1}".format(node.keyword, title)
+        self.write([self.headline(node, title)])
+        self.end_block()
+
+    depart_paragraph = depart_verse = end_block
+
+    def visit_quote(self, node, depth):
+        self.open_block()
+        self.prefixes.append(self.quote)
+
+    def depart_quote(self, node, depth):
+        self.prefixes.pop()
+        self.separate = True
+
+    def open_list(self):
+        # items and the lists nested in them stay tight, blocks within an
+        # item are still separated
+        if self.lists:
+            self.separate = False
+        self.open_block()
+
+    def visit_list(self, node, depth):
+        self.open_list()
+        self.lists.append(None)
+
+    def visit_order_list(self, node, depth):
+        self.open_list()
+        self.lists.append(0)
+
+    def depart_list(self, node, depth):
+        self.lists.pop()
+        self.separate = True
+
+    def visit_list_item(self, node, depth):
+        count = self.lists[-1] if self.lists else None
+        if count is None:
+            bullet = self.bullet
+        else:
+            count += 1
+            self.lists[-1] = count
+            bullet = "{0}. ".format(count)
+        self.separate = False
+        self.marker = "".join(self.prefixes) + bullet
+        if node.status is not None:
+            self.marker += self.status.get(node.status, "")
+        self.prefixes.append(" " * len(bullet))
+
+    def depart_list_item(self, node, depth):
+        self.prefixes.pop()
+        if self.marker is not None:
+            self.write([""])
+
+    def visit_table(self, node, depth):
+        self.rows = []
+
+    def depart_table(self, node, depth):
+        rows = [cells for _, cells in self.rows]
+        header_rows = 0
+        for header, _ in self.rows:
+            if not header:
+                break
+            header_rows += 1
+        self.rows = None
+        if rows:
+            self.write(self.table(rows, header_rows))
+            self.end_block()
+
+    def visit_table_row(self, node, depth):
+        self.rows.append((node.header, []))
+
+    def visit_table_column(self, node, depth):
+        self.texts = []
+
+    def depart_table_column(self, node, depth):
+        self.rows[-1][1].append(" ".join(self.texts))
+        self.texts = None
+
+    def visit_fast_table(self, node, depth):
+        rows = []
+        for cells in node.rows:
+            rows.append([
+                self.inline_text(node.inlinetext(cell)) for cell in cells
+            ])
+        if rows:
+            self.write(self.table(rows, node.header_rows))
+            self.end_block()
+        return False
+
+    def depart_fast_table(self, node, depth):
+        pass
+
+    def visit_src(self, node, depth):
+        self.write(self.code(node.language, node.code().split("\n")), True)
+        self.end_block()
+        return False
+
+    def visit_example(self, node, depth):
+        self.write(self.code("", node.code().split("\n")), True)
+        self.end_block()
+        return False
+
+    def visit_block_result(self, node, depth):
+        lines = [
+            child.content for child, _, entering in node.walk()
+            if entering and hasattr(child, "parse_children")
+        ]
+        self.write(self.code("", lines), True)
+        self.end_block()
+        return False
+
+    def visit_export(self, node, depth):
+        return False
+
+    def visit_drawer(self, node, depth):
+        return False
+
+    def visit_keyword(self, node, depth):
+        return False
+
+    def visit_blankline(self, node, depth):
+        return False
+
+    def visit_hr(self, node, depth):
+        return False
+
+    def visit_inline_text(self, node, depth):
+        # nodes that are not parsed only hold html, such as checkboxes
+        if not node.needparse:
+            return False
+        self.pieces = []
+
+    def depart_inline_text(self, node, depth):
+        if self.pieces is None:
+            return
+        text = "".join(self.pieces).strip()
+        self.pieces = None
+        if self.texts is None:
+            self.write([text])
+        else:
+            self.texts.append(text)
+
+    def visit_text(self, node, depth):
+        self.pieces.append(self.escape(unescape(node.content)))
+
+    def emphasis(self, node, depth):
+        self.pieces.append(self.markers.get(node.__class__.__name__, ""))
+
+    visit_bold = depart_bold = emphasis
+    visit_italic = depart_italic = emphasis
+    visit_delete = depart_delete = emphasis
+    visit_underline = depart_underline = emphasis
+
+    def visit_code(self, node, depth):
+        marker = self.markers.get(node.__class__.__name__, "")
+        self.pieces.append(marker + unescape(node.content) + marker)
+        return False
+
+    visit_verbatim = visit_code
+
+    def visit_percent(self, node, depth):
+        marker = self.markers.get("Code", "")
+        self.pieces.append("{0}[{1}]{0}".format(marker,
+                                                unescape(node.content)))
+        return False
+
+    def visit_link(self, node, depth):
+        self.pieces.append(self.link(node))
+        return False
+
+    def visit_fn(self, node, depth):
+        self.pieces.append(self.footnote(node))
+        return False
+
+    def visit_newline(self, node, depth):
+        self.pieces.append(self.newline(node))
+
+
+class MarkdownExporter(TextExporter):
+    quote = "> "
+    markers = {
+        "Bold": "**",
+        "Italic": "*",
+        "Delete": "~~",
+        "Code": "`",
+        "Verbatim": "`",
+    }
+    status = {"X": "[x] ", "-": "[ ] ", " ": "[ ] "}
+
+    def __init__(self):
+        super(MarkdownExporter, self).__init__()
+        self.verse = None
+
+    def escape(self, text):
+        return MARKDOWN_ESCAPE_REGEXP.sub(r"\\\1", text)
+
+    def headline(self, node, title):
+        return "{0} {1}".format("#" * node.stars, title)
+
+    def code(self, language, lines):
+        return ["```" + language] + lines + ["```"]
+
+    def table(self, rows, header_rows):
+        columns = max(len(cells) for cells in rows)
+        lines = []
+        for cells in rows:
+            cells = cells + [""] * (columns - len(cells))
+            lines.append("| {0} |".format(" | ".join(cells)))
+        lines.insert(max(header_rows, 1), "|{0}".format("---|" * columns))
+        return lines
+
+    def link(self, node):
+        url = unescape(node.content)
+        if node.is_img():
+            return "![]({0})".format(url)
+        desc = self.escape(unescape(node.desc or node.content))
+        return "[{0}]({1})".format(desc, url)
+
+    def footnote(self, node):
+        return "[^{0}]".format(unescape(node.content))
+
+    def newline(self, node):
+        return "\\"
+
+    def visit_verse(self, node, depth):
+        self.verse = len(self.lines)
+
+    def depart_verse(self, node, depth):
+        # consecutive lines of a verse end with a hard line break
+        lines = self.lines
+        for num in range(max(self.verse, 1), len(lines)):
+            if lines[num - 1].strip(">") and lines[num].strip(">"):
+                lines[num - 1] += "\\"
+        self.end_block()
+
+    def visit_export(self, node, depth):
+        if not node.escape:
+            self.write(node.to_html().split("\n"), True)
+            self.end_block()
+        return False
+
+    def visit_hr(self, node, depth):
+        self.write(["---"])
+        self.end_block()
+        return False
+
+
+EXPORTERS = {
+    "html": HtmlExporter,
+    "text": TextExporter,
+    "markdown": MarkdownExporter,
+}
@@ -12,6 +12,9 @@
 # ********************************************************************************
 import re
 import os
+from bisect import bisect_left
+
+from .visitor import walk_nodes
 
 # _inline_regexp = r"(^|.*?(?<![/\\])){0}(.+?(?<![/\\])){0}(.*?|$)"
 _inline_regexp = r"(^|.*?(?<![/\\])){0}(.+?(?<![/\\])){0}(.*?|$)"
@@ -23,6 +26,16 @@ DELETE_REGEXP = re.compile(_inline_regexp.format('\\+'))
 VERBATIM_REGEXP = re.compile(_inline_regexp.format('~'))
 UNDERLINE_REGEXP = re.compile(_inline_regexp.format('_'))
 
+_delimiter_regexp = r"(?<![/\\])(?={0})"
+
+BOLD_DELIMITER_REGEXP = re.compile(_delimiter_regexp.format('\\*'))
+CODE_DELIMITER_REGEXP = re.compile(_delimiter_regexp.format('(?:\\=|`)'))
+ITALIC_DELIMITER_REGEXP = re.compile(
+    _delimiter_regexp.format('(?:\\*\\*|\\/)'))
+DELETE_DELIMITER_REGEXP = re.compile(_delimiter_regexp.format('\\+'))
+VERBATIM_DELIMITER_REGEXP = re.compile(_delimiter_regexp.format('~'))
+UNDERLINE_DELIMITER_REGEXP = re.compile(_delimiter_regexp.format('_'))
+
 PERCENT_REGEXP = re.compile(r"\[(\d+/\d+|\d+%)\]")
 
 HR_REGEXP = re.compile(r"^\s*\-{5,}\s*")
@@ -37,13 +50,7 @@ BLANKLINE_REGEXP = re.compile(r"^(\s*)$")
 TIMESTAMP_REGEXP = re.compile(
     r"^<(\d{4}-\d{2}-\d{2})( [A-Za-z]+)?( \d{2}:\d{2})?( \+\d+[dwmy])?>")
 
-_html_escape = (
-    ("&", "&amp;"),
-    ("'", "&#39;"),
-    ("<", "&lt;"),
-    (">", "&gt;"),
-    ("\"", "&#34;"),
-)
+TRIGGER_REGEXP = re.compile(r"[=`~_+/*\[\\]")
 
 # https://github.com/tsroten/zhon/blob/develop/zhon/hanzi.py
 _chinese_non_stops = (
@@ -97,9 +104,10 @@ _chinese_stops = (
 
 
 def html_escape(text):
-    for e in _html_escape:
-        text = text.replace(e[0], e[1])
-    return text
+    # each replace is a single C scan that returns text itself when the
+    # character is absent, str.translate and re.sub are both slower here
+    return text.replace("&", "&amp;").replace("'", "&#39;").replace(
+        "<", "&lt;").replace(">", "&gt;").replace("\"", "&#34;")
 
 
 def match_chinese(ch):
@@ -110,53 +118,118 @@ def match_chinese(ch):
     return ch in _chinese_non_stops
 
 
-def match_emphasis(cls, regexp, line, index):
-    match = regexp.match(line, index)
-    if not match:
-        return None, index
+def delimiter_length(markers, line, index):
+    for marker in markers:
+        if line.startswith(marker, index):
+            return len(marker)
+    return 0
 
-    end = match.end()
 
+def match_emphasis(cls, line, index, delimiters=None):
     if index != 0:
         prechar = line[index - 1]
         border = prechar != " " and prechar not in "-({'\""
         if border and not match_chinese(prechar):
             return None, index
 
+    length = delimiter_length(cls.markers, line, index)
+    if not length:
+        return None, index
+
+    if delimiters is None:
+        delimiters = Delimiters(line)
+    start = index + length
+    close = delimiters.closer(cls.delimiter, start + 1)
+    if close < 0 or delimiters.has_newline(start, close):
+        return None, index
+
+    end = close + delimiter_length(cls.markers, line, close)
     if end < len(line):
         endchar = line[end]
         border = endchar != " " and endchar not in "-.,:!?;'\")}["
         if border and not match_chinese(endchar):
             return None, index
-    return cls(match[2]), end - 1
+    return cls(line[start:close]), end - 1
+
+
+class Delimiters(object):
+    def __init__(self, line):
+        self.line = line
+        self.positions = {}
+        self.newlines = None
+        self.linebreak = None
+
+    def closer(self, regexp, index):
+        positions = self.positions.get(regexp)
+        if positions is None:
+            positions = [m.start() for m in regexp.finditer(self.line)]
+            self.positions[regexp] = positions
+
+        i = bisect_left(positions, index)
+        if i == len(positions):
+            return -1
+        return positions[i]
+
+    def has_newline(self, start, end):
+        if self.newlines is None:
+            self.newlines = [
+                m.start() for m in re.finditer("\n", self.line)
+            ]
+        if not self.newlines:
+            return False
+
+        i = bisect_left(self.newlines, start)
+        return i < len(self.newlines) and self.newlines[i] < end
+
+    def trailing_linebreak(self):
+        if self.linebreak is None:
+            line = self.line.rstrip()
+            if line.endswith("\\\\"):
+                self.linebreak = len(line) - 2
+            else:
+                self.linebreak = -1
+        return self.linebreak
 
 
 class InlineParser(object):
+    __slots__ = ("content", "children")
+
+    _scratch_classes = {}
+
+    element = ""
+
     def __init__(self, content=""):
         self.content = content
-        self.children = []
-        self.element = ""
+        self.children = ()
 
     def add_child(self, child):
+        if not self.children:
+            self.children = [child]
+            return
         self.children.append(child)
 
+    def delimiters(self, lines):
+        if self._delimiters is None or self._delimiters.line is not lines:
+            self._delimiters = Delimiters(lines)
+        return self._delimiters
+
     def parse_code(self, index, lines):
-        return Code.match(lines, index)
+        return Code.match(lines, index, self.delimiters(lines))
 
     def parse_bold(self, index, lines):
-        return Bold.match(lines, index)
+        return Bold.match(lines, index, self.delimiters(lines))
 
     def parse_italic(self, index, lines):
-        return Italic.match(lines, index)
+        return Italic.match(lines, index, self.delimiters(lines))
 
     def parse_delete(self, index, lines):
-        return Delete.match(lines, index)
+        return Delete.match(lines, index, self.delimiters(lines))
 
     def parse_verbatim(self, index, lines):
-        return Verbatim.match(lines, index)
+        return Verbatim.match(lines, index, self.delimiters(lines))
 
     def parse_underline(self, index, lines):
-        return Underline.match(lines, index)
+        return Underline.match(lines, index, self.delimiters(lines))
 
     def parse_percent(self, index, lines):
         return Percent.match(lines, index)
@@ -168,7 +241,7 @@ class InlineParser(object):
         return Fn.match(lines, index)
 
     def parse_newline(self, index, lines):
-        return Newline.match(lines, index)
+        return Newline.match(lines, index, self.delimiters(lines))
 
     def parse(self, index, lines):
         chars = (
@@ -208,19 +281,84 @@ class InlineParser(object):
             return None, index
         return Text(single_char), index
 
+    def parse_trigger(self, index, lines):
+        for prefix, parse in _inline_triggers[lines[index]]:
+            if not lines.startswith(prefix, index):
+                continue
+            node, num = parse(self, index, lines)
+            if node:
+                return node, num
+        return None, index
+
     def last_child(self):
         if len(self.children) == 0:
             return
         return self.children[-1]
 
+    def set_inline_engine(self, engine):
+        pass
+
+    def scratch(self):
+        # parsing keeps state in the parser itself, a private one means a
+        # tree shared between threads only ever sees complete children
+        node_class = self.__class__
+        scratch_class = self._scratch_classes.get(node_class)
+        if scratch_class is None:
+            # only scratch parsers carry the delimiter index, nodes kept in
+            # the tree do not reserve a slot for it
+            scratch_class = type(
+                node_class.__name__,
+                (node_class, ),
+                {"__slots__": ("_delimiters", )},
+            )
+            scratch_class = self._scratch_classes.setdefault(
+                node_class, scratch_class)
+        parser = scratch_class.__new__(scratch_class)
+        parser.content = self.content
+        parser.children = []
+        parser._delimiters = None
+        return parser
+
+    def fastparse(self, lines):
+        parser = self.scratch()
+        children = []
+        start = index = 0
+        while True:
+            match = TRIGGER_REGEXP.search(lines, index)
+            if not match:
+                break
+            index = match.start()
+            node, num = parser.parse_trigger(index, lines)
+            if not node:
+                index += 1
+                continue
+            if start < index:
+                children.append(Text(lines[start:index]))
+            if node.element:
+                node.children = node.fastparse(node.content)
+            children.append(node)
+            index = start = num + 1
+        if start < len(lines):
+            children.append(Text(lines[start:]))
+        return children
+
     def preparse(self, lines):
+        parser = self.scratch()
         index = 0
         while index < len(lines):
-            block, index = self.parse(index, lines)
+            block, index = parser.parse(index, lines)
             index += 1
             if not block:
                 continue
-            self.add_child(block)
+            parser.add_child(block)
+        self.children = parser.children
+
+    def parse_children(self):
+        if self.element and len(self.children) == 0 and self.content:
+            self.preparse(self.content)
+
+    def walk(self, inline=False):
+        return walk_nodes((self, ), 0, inline)
 
     def to_html(self):
         if len(self.children) == 0 and self.content:
@@ -231,6 +369,9 @@ class InlineParser(object):
             return self.element.format(text)
         return text
 
+    def iter_html(self):
+        yield self.to_html()
+
     def __str__(self):
         return '{}({})'.format(self.__class__.__name__, self.content.strip())
 
@@ -239,86 +380,109 @@ class InlineParser(object):
 
 
 class Text(InlineParser):
+    __slots__ = ()
+
     def to_html(self):
         return self.content
 
 
 class Newline(InlineParser):
+    __slots__ = ()
+
     @classmethod
-    def match(cls, line, index):
-        match = NEWLINE_REGEXP.match(line, index)
-        if not match:
+    def match(cls, line, index, delimiters=None):
+        if delimiters is None:
+            delimiters = Delimiters(line)
+
+        start = delimiters.trailing_linebreak()
+        if start < index:
+            return None, index
+        if start > 0 and line[start - 1] in "/\\":
             return None, index
-        return cls(), match.end() - 1
+        if delimiters.has_newline(index, start):
+            return None, index
+        return cls(), len(line) - 1
 
     def to_html(self):
         return "<br/>"
 
 
 class Bold(InlineParser):
-    def __init__(self, content):
-        super(Bold, self).__init__(content)
-        self.element = "<b>{0}</b>"
+    __slots__ = ()
+
+    markers = ("*", )
+    delimiter = BOLD_DELIMITER_REGEXP
+    element = "<b>{0}</b>"
 
     @classmethod
-    def match(cls, line, index):
-        return match_emphasis(cls, BOLD_REGEXP, line, index)
+    def match(cls, line, index, delimiters=None):
+        return match_emphasis(cls, line, index, delimiters)
 
 
 class Code(InlineParser):
-    def __init__(self, content):
-        super(Code, self).__init__(content)
-        self.element = "<code>{0}</code>"
+    __slots__ = ()
+
+    markers = ("=", "`")
+    delimiter = CODE_DELIMITER_REGEXP
+    element = "<code>{0}</code>"
 
     @classmethod
-    def match(cls, line, index):
-        return match_emphasis(cls, CODE_REGEXP, line, index)
+    def match(cls, line, index, delimiters=None):
+        return match_emphasis(cls, line, index, delimiters)
 
 
 class Italic(InlineParser):
-    def __init__(self, content):
-        super(Italic, self).__init__(content)
-        self.element = "<i>{0}</i>"
+    __slots__ = ()
+
+    markers = ("**", "/")
+    delimiter = ITALIC_DELIMITER_REGEXP
+    element = "<i>{0}</i>"
 
     @classmethod
-    def match(cls, line, index):
-        return match_emphasis(cls, ITALIC_REGEXP, line, index)
+    def match(cls, line, index, delimiters=None):
+        return match_emphasis(cls, line, index, delimiters)
 
 
 class Delete(InlineParser):
-    def __init__(self, content):
-        super(Delete, self).__init__(content)
-        self.element = "<del>{0}</del>"
+    __slots__ = ()
+
+    markers = ("+", )
+    delimiter = DELETE_DELIMITER_REGEXP
+    element = "<del>{0}</del>"
 
     @classmethod
-    def match(cls, line, index):
-        return match_emphasis(cls, DELETE_REGEXP, line, index)
+    def match(cls, line, index, delimiters=None):
+        return match_emphasis(cls, line, index, delimiters)
 
 
 class Verbatim(InlineParser):
-    def __init__(self, content):
-        super(Verbatim, self).__init__(content)
-        self.element = "<code>{0}</code>"
+    __slots__ = ()
+
+    markers = ("~", )
+    delimiter = VERBATIM_DELIMITER_REGEXP
+    element = "<code>{0}</code>"
 
     @classmethod
-    def match(cls, line, index):
-        return match_emphasis(cls, VERBATIM_REGEXP, line, index)
+    def match(cls, line, index, delimiters=None):
+        return match_emphasis(cls, line, index, delimiters)
 
 
 class Underline(InlineParser):
-    def __init__(self, content):
-        super(Underline, self).__init__(content)
-        self.element = "<span style=\"text-decoration:underline\">{0}</span>"
+    __slots__ = ()
+
+    markers = ("_", )
+    delimiter = UNDERLINE_DELIMITER_REGEXP
+    element = "<span style=\"text-decoration:underline\">{0}</span>"
 
     @classmethod
-    def match(cls, line, index):
-        return match_emphasis(cls, UNDERLINE_REGEXP, line, index)
+    def match(cls, line, index, delimiters=None):
+        return match_emphasis(cls, line, index, delimiters)
 
 
 class Percent(InlineParser):
-    def __init__(self, content):
-        super(Percent, self).__init__(content)
-        self.element = "<code>[{0}]</code>"
+    __slots__ = ()
+
+    element = "<code>[{0}]</code>"
 
     @classmethod
     def match(cls, line, index):
@@ -329,6 +493,8 @@ class Percent(InlineParser):
 
 
 class Link(InlineParser):
+    __slots__ = ("desc", )
+
     def __init__(self, url, desc=None):
         super(Link, self).__init__(url)
         self.desc = desc
@@ -359,9 +525,9 @@ class Link(InlineParser):
 
 
 class Fn(InlineParser):
-    def __init__(self, content):
-        super(Fn, self).__init__(content)
-        self.element = '<sup><a id="fnr:{0}" class="footref" href="#fn.{0}">{0}</a></sup>'
+    __slots__ = ()
+
+    element = '<sup><a id="fnr:{0}" class="footref" href="#fn.{0}">{0}</a></sup>'
 
     @classmethod
     def match(cls, line, index):
@@ -375,6 +541,8 @@ class Fn(InlineParser):
 
 
 class Timestamp(InlineParser):
+    __slots__ = ("date", "time", "interval")
+
     def __init__(self, date="", time="", interval=None):
         super(Timestamp, self).__init__()
         self.date = date
@@ -390,8 +558,7 @@ class Timestamp(InlineParser):
 
 
 class Blankline(InlineParser):
-    def __init__(self):
-        super(Blankline, self).__init__()
+    __slots__ = ("level", )
 
     @classmethod
     def match(cls, line):
@@ -405,8 +572,7 @@ class Blankline(InlineParser):
 
 
 class Hr(InlineParser):
-    def __init__(self):
-        super(Hr, self).__init__()
+    __slots__ = ("level", )
 
     @classmethod
     def match(cls, line):
@@ -419,14 +585,56 @@ class Hr(InlineParser):
 
 
 class InlineText(InlineParser):
-    def __init__(self, content="", needparse=True, escape=True):
+    __slots__ = ("level", "needparse", "escape", "engine")
+
+    def __init__(self, content="", needparse=True, escape=True,
+                 engine="default"):
         super(InlineText, self).__init__(content)
+        self.level = 0
         self.needparse = needparse
         self.escape = escape
+        self.engine = engine
 
-    def to_html(self):
+    def set_inline_engine(self, engine):
+        self.engine = engine
+
+    def parse_children(self):
+        if not self.needparse or self.children:
+            return
+
+        content = self.content
         if self.escape:
-            self.content = html_escape(self.content)
+            content = html_escape(content)
+        if content:
+            if self.engine == "fast":
+                self.children = self.fastparse(content)
+            else:
+                self.preparse(content)
+
+    def to_html(self):
         if not self.needparse:
+            if self.escape:
+                return html_escape(self.content)
             return self.content
+        self.parse_children()
         return super(InlineText, self).to_html()
+
+
+_inline_triggers = {
+    "=": (("=", InlineParser.parse_code), ),
+    "`": (("`", InlineParser.parse_code), ),
+    "~": (("~", InlineParser.parse_verbatim), ),
+    "_": (("_", InlineParser.parse_underline), ),
+    "+": (("+", InlineParser.parse_delete), ),
+    "/": (("/", InlineParser.parse_italic), ),
+    "*": (
+        ("**", InlineParser.parse_italic),
+        ("*", InlineParser.parse_bold),
+    ),
+    "[": (
+        ("[[", InlineParser.parse_link),
+        ("[", InlineParser.parse_percent),
+        ("[fn", InlineParser.parse_fn),
+    ),
+    "\\": (("\\", InlineParser.parse_newline), ),
+}
@@ -10,21 +10,201 @@
 #          By:
 # Description:
 # ********************************************************************************
-try:
-    import pygments
-    from pygments import lexers
-    from pygments import formatters
-except ImportError:
-    pygments = None
+import os
+from collections import deque
+from hashlib import sha1
+from time import perf_counter
 
+from .cache import LRUCache
+
+LEXER_CACHE_SIZE = 128
+FORMATTER_OPTIONS = {}
+
+lexer_cache = LRUCache(max_entries=LEXER_CACHE_SIZE)
+guess_cache = LRUCache(max_entries=LEXER_CACHE_SIZE)
+highlight_cache = LRUCache(max_entries=4096, max_bytes=32 * 1024 * 1024)
+store = None
+pygments = None
+lexers = None
+formatters = None
+_formatter = None
+_available = None
+
+
+class Timings(object):
+    def __init__(self, maxlen=1024):
+        self.blocks = deque(maxlen=maxlen)
+        self.count = 0
+        self.seconds = 0.0
+
+    def record(self, language, seconds):
+        self.blocks.append((language, seconds))
+        self.count += 1
+        self.seconds += seconds
+
+    def reset(self):
+        self.blocks.clear()
+        self.count = 0
+        self.seconds = 0.0
+
+
+class FileStore(object):
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+
+    def filename(self, key):
+        return os.path.join(self.path, key[:2], key[2:] + ".html")
+
+    def get(self, key):
+        try:
+            with open(self.filename(key), encoding="utf-8", newline="") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, key, value):
+        import tempfile
+
+        # a store that cannot be written only costs a cache miss
+        filename = self.filename(key)
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(".tmp", dir=os.path.dirname(filename))
+        except OSError:
+            return
+        try:
+            with open(fd, "w", encoding="utf-8", newline="") as f:
+                f.write(value)
+            os.replace(tmp, filename)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+
+timings = Timings()
+
+
+def available():
+    global pygments, lexers, formatters, _available
+    if _available is None:
+        try:
+            import pygments
+            from pygments import lexers
+            from pygments import formatters
+        except ImportError:
+            pygments = None
+        _available = pygments is not None
+    return _available
+
+
+def get_lexer(language):
+    lexer = lexer_cache.get(language)
+    if lexer is None:
+        try:
+            lexer = lexers.get_lexer_by_name(language)
+        except pygments.util.ClassNotFound:
+            lexer = False
+        lexer_cache.set(language, lexer)
+    return lexer or None
 
-def highlight(language, text):
-    if pygments is None:
-        return text
 
-    try:
-        lexer = lexers.get_lexer_by_name(language)
-    except pygments.util.ClassNotFound:
+def get_formatter():
+    global _formatter
+    if _formatter is None:
+        _formatter = formatters.HtmlFormatter(**FORMATTER_OPTIONS)
+    return _formatter
+
+
+def guess_lexer(language, text, guess=True):
+    if not guess:
+        return get_lexer("text")
+    if guess != "language":
+        return lexers.guess_lexer(text)
+
+    lexer = guess_cache.get(language)
+    if lexer is None:
         lexer = lexers.guess_lexer(text)
-    formatter = formatters.HtmlFormatter()
-    return pygments.highlight(text, lexer, formatter)
+        guess_cache.set(language, lexer)
+    return lexer
+
+
+def highlight_key(language, text, guess=True):
+    key = "\0".join([
+        pygments.__version__,
+        language,
+        repr(guess),
+        repr(sorted(FORMATTER_OPTIONS.items())),
+        text,
+    ])
+    return sha1(key.encode("utf-8")).hexdigest()
+
+
+def render(language, text, guess=True, lexer=None):
+    available()
+    if lexer is None:
+        lexer = get_lexer(language)
+    if lexer is None:
+        lexer = guess_lexer(language, text, guess)
+    return pygments.highlight(text, lexer, get_formatter())
+
+
+def cached(key):
+    html = highlight_cache.get(key)
+    if html is None and store is not None:
+        html = store.get(key)
+        if html is not None:
+            highlight_cache.set(key, html)
+    return html
+
+
+def save(key, html):
+    highlight_cache.set(key, html)
+    if store is not None:
+        store.set(key, html)
+
+
+def highlight(language, text, guess=True):
+    if not available():
+        return text
+
+    start = perf_counter()
+    key = highlight_key(language, text, guess)
+    html = cached(key)
+    if html is None:
+        html = render(language, text, guess)
+        save(key, html)
+    timings.record(language, perf_counter() - start)
+    return html
+
+
+def highlight_many(blocks, executor):
+    if not available():
+        return []
+
+    keys = []
+    results = {}
+    futures = {}
+    for language, text, guess in blocks:
+        key = highlight_key(language, text, guess)
+        keys.append(key)
+        if key in results or key in futures:
+            continue
+        html = cached(key)
+        if html is not None:
+            results[key] = html
+            continue
+        # memoised guesses depend on which block comes first, so they are
+        # made here in document order
+        lexer = None
+        if guess == "language" and get_lexer(language) is None:
+            lexer = guess_lexer(language, text, guess)
+        futures[key] = executor.submit(render, language, text, guess, lexer)
+
+    for key, future in futures.items():
+        results[key] = future.result()
+        save(key, results[key])
+    # the results go back to the caller, a document with more blocks than
+    # the cache holds would otherwise lose the first ones before rendering
+    return [results[key] for key in keys]
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ********************************************************************************
+# Copyright © 2017-2020 jianglin
+# File Name: visitor.py
+# Author: jianglin
+# Email: mail@honmaple.com
+# Created: 2020-08-24 21:05:16 (CST)
+# Last Update:
+#          By:
+# Description:
+# ********************************************************************************
+import re
+
+NAME_REGEXP = re.compile(r"(?<!^)(?=[A-Z])")
+
+
+def method_name(prefix, cls):
+    return prefix + "_" + NAME_REGEXP.sub("_", cls.__name__).lower()
+
+
+def walk_nodes(nodes, depth=0, inline=False):
+    # yields (node, depth, True) before the children of a node and
+    # (node, depth, False) after them, the stack holds the children left
+    # to walk for every entered node. Inline nodes parse their children
+    # on demand, and are only entered when inline is set
+    stack = [(None, iter(nodes))]
+    while stack:
+        parent, pending = stack[-1]
+        for node in pending:
+            level = depth + len(stack) - 1
+            yield node, level, True
+            parse_children = getattr(node, "parse_children", None)
+            if parse_children is None:
+                children = node.children
+            elif inline:
+                parse_children()
+                children = node.children
+            else:
+                children = ()
+            if children:
+                stack.append((node, iter(children)))
+                break
+            yield node, level, False
+        else:
+            stack.pop()
+            if stack:
+                yield parent, depth + len(stack) - 1, False
+
+
+class Visitor(object):
+    _dispatch_tables = {}
+
+    _skip = None
+
+    def dispatch_table(self):
+        table = self._dispatch_tables.get(self.__class__)
+        if table is None:
+            table = self._dispatch_tables.setdefault(self.__class__, {})
+        return table
+
+    def dispatch(self, node_class):
+        table = self.dispatch_table()
+        methods = table.get(node_class)
+        if methods is None:
+            methods = table.setdefault(node_class, (
+                self._method("visit", node_class),
+                self._method("depart", node_class),
+            ))
+        return methods
+
+    def _method(self, prefix, node_class):
+        # visit_unorder_list falls back to visit_list, visit_parser and
+        # finally generic_visit, which is skipped unless it is overridden
+        for cls in node_class.__mro__:
+            func = getattr(self.__class__, method_name(prefix, cls), None)
+            if func is not None:
+                return func
+        func = getattr(self.__class__, "generic_" + prefix)
+        if func is getattr(Visitor, "generic_" + prefix):
+            return None
+        return func
+
+    def generic_visit(self, node, depth):
+        pass
+
+    def generic_depart(self, node, depth):
+        pass
+
+    def event(self, node, depth, entering):
+        # a visit method that returns False skips the children of the node,
+        # the node itself is still departed
+        if self._skip is not None:
+            if node is not self._skip or entering:
+                return
+            self._skip = None
+
+        methods = self.dispatch_table().get(node.__class__)
+        if methods is None:
+            methods = self.dispatch(node.__class__)
+        visit, depart = methods
+        if entering:
+            if visit is not None and visit(self, node, depth) is False:
+                self._skip = node
+        elif depart is not None:
+            depart(self, node, depth)
+
+    def run(self, node, inline=False):
+        event = self.event
+        for child, depth, entering in node.walk(inline):
+            event(child, depth, entering)
+        return self
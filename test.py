@@ -10,8 +10,23 @@
 #          By:
 # Description:
 # **************************************************************************
+import io
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import threading
 import unittest
-from orgpython import Block
+from concurrent.futures import ProcessPoolExecutor
+from orgpython import (convert_many, iter_html, parse_file, to_html,
+                       to_html_file, to_markdown, to_text)
+from orgpython import src
+from orgpython.cache import LRUCache
+from orgpython.document import (Block, Document, Drawer, Example,
+                                UnorderList)
+from orgpython.inline import InlineText
+from orgpython.visitor import Visitor
 
 TEXT = '''* Heading1
 ** Heading2
@@ -29,8 +44,8 @@ class TestOrg(unittest.TestCase):
     def test_heading(self):
         text = "* TODO heading  :TAG1:TAG2:"
 
-        b = Block(text)
-        b.init()
+        b = Document(text)
+        b.preparse(b.lines)
         heading = b.children[0]
         self.assertEqual(heading.title, "heading")
         self.assertEqual(heading.stars, 1)
@@ -38,19 +53,601 @@ class TestOrg(unittest.TestCase):
         self.assertEqual(heading.keyword, "TODO")
 
         text = "* [#B] heading  :TAG1:TAG2:"
-        b = Block(text)
-        b.init()
+        b = Document(text)
+        b.preparse(b.lines)
         heading = b.children[0]
 
-        self.assertEqual(heading.title, "heading")
+        self.assertEqual(heading.title.strip(), "heading")
         self.assertEqual(heading.stars, 1)
         self.assertEqual(heading.tags, ["TAG1", "TAG2"])
-        self.assertEqual(heading.keyword, None)
-        self.assertEqual(heading.priority, "[#B]")
+        self.assertFalse(heading.keyword)
+        self.assertEqual(heading.priority, "B")
+
+    def test_headline_id(self):
+        text = "* a\n:PROPERTIES:\n:CUSTOM_ID: c\n:END:\n* b"
+        for headline_id in ("sha1", "blake2b"):
+            doc = Document(text, headline_id=headline_id, toc="t")
+            html = doc.to_html()
+            headline = doc.children[1]
+            self.assertIs(headline.id(), headline.id())
+            self.assertIn('href="#{0}"'.format(headline.id()), html)
+            self.assertIn('id="{0}"'.format(headline.id()), html)
+            self.assertIn('id="c"', html)
+        self.assertEqual(headline.id(), "org-d24293724e")
 
     def test_src(self):
         pass
 
+    def test_inline_engine(self):
+        text = TEXT + "\n".join([
+            "- [X] +delete+ _underline_ /italic/ [50%] [1/3] `code`",
+            "text[fn:1] with a newline \\\\",
+            "| *th* | =th= |",
+            "|------+------|",
+            "| [[a.png]] | [[http://a.com][a]] |",
+        ])
+        self.assertEqual(
+            to_html(text, inline_engine="fast"),
+            to_html(text),
+        )
+
+    def test_table_engine(self):
+        text = "\n".join([
+            "|---|",
+            "| *th* | <b> |",
+            "|------+-----|",
+            "| [[a.png]] | |  ",
+            "|---|",
+            "| a |",
+        ])
+        for options in ({}, {"toc": "t"}, {"inline_engine": "fast"}):
+            self.assertEqual(
+                to_html(text, table_engine="fast", **options),
+                to_html(text, **options),
+            )
+
+        text = "| <l> | <r> | |\n| a | b | c |\n|---|\n| 1 | 2 | 3 |"
+        self.assertEqual(
+            to_html(text, table_engine="fast"),
+            "<table>\n<tr>\n"
+            "<th style=\"text-align: left;\">a</th>\n"
+            "<th style=\"text-align: right;\">b</th>\n<th>c</th>"
+            "\n</tr>\n<tr>\n"
+            "<td style=\"text-align: left;\">1</td>\n"
+            "<td style=\"text-align: right;\">2</td>\n<td>3</td>"
+            "\n</tr>\n</table>",
+        )
+
+    def test_list_engine(self):
+        text = "\n".join([
+            "- [X] a",
+            "  1. b",
+            "  2) c",
+            "     - [ ] d",
+            "",
+            "  text",
+            "  - e",
+            "+",
+            "* f",
+            "  * g",
+            "    #+BEGIN_QUOTE",
+            "    - h",
+            "    #+END_QUOTE",
+        ])
+        for options in ({}, {"toc": "t"}):
+            self.assertEqual(
+                to_html(text, list_engine="fast", **options),
+                to_html(text, **options),
+            )
+        self.assertEqual(to_html("-"), to_html("- "))
+        self.assertIsNot(UnorderList().children, UnorderList().children)
+
+    def test_walk(self):
+        doc = Document("* a\n- b [[c]]\n  1. d")
+        self.assertEqual(
+            [(node.__class__.__name__, depth, entering)
+             for node, depth, entering in doc.walk()][:8],
+            [
+                ("Document", 0, True),
+                ("Headline", 1, True),
+                ("UnorderList", 2, True),
+                ("ListItem", 3, True),
+                ("Paragraph", 4, True),
+                ("InlineText", 5, True),
+                ("InlineText", 5, False),
+                ("Paragraph", 4, False),
+            ],
+        )
+
+        class Collector(Visitor):
+            def __init__(self):
+                self.nodes = []
+
+            def visit_list(self, node, depth):
+                self.nodes.append(node.__class__.__name__)
+
+            def visit_link(self, node, depth):
+                self.nodes.append(node.content)
+
+        self.assertEqual(
+            Collector().run(doc, inline=True).nodes,
+            ["UnorderList", "c", "OrderList"],
+        )
+        html = doc.to_html()
+        self.assertEqual(html, to_html("* a\n- b [[c]]\n  1. d"))
+
+        depth = 5000
+        doc = Document("\n".join(
+            ["*" * num + " heading" for num in range(1, depth + 1)]))
+        self.assertEqual(max(level for _, level, _ in doc.walk()), depth)
+
+    def test_render(self):
+        text = "\n".join([
+            "* TODO Heading *bold*",
+            "see =code= and [[https://a.com][link]]",
+            "- [X] one",
+            "- two",
+            "  1. three",
+            "#+BEGIN_QUOTE",
+            "quoted",
+            "#+END_QUOTE",
+            "#+BEGIN_SRC python",
+            "x = 1",
+            "#+END_SRC",
+            "| a | b |",
+            "|---+---|",
+            "| c | d |",
+        ])
+        self.assertEqual(
+            to_text(text),
+            "TODO Heading bold\n\nsee code and link\n\n- [X] one\n- two\n"
+            "  1. three\n\nquoted\n\nx = 1\n\na | b\nc | d",
+        )
+        self.assertEqual(
+            to_markdown(text),
+            "# TODO Heading **bold**\n\nsee `code` and [link](https://a.com)"
+            "\n\n- [x] one\n- two\n  1. three\n\n> quoted\n\n"
+            "```python\nx = 1\n```\n\n| a | b |\n|---|---|\n| c | d |",
+        )
+        self.assertEqual(to_markdown("- a\n\n  para\n- b"),
+                         "- a\n\n  para\n- b")
+        self.assertEqual(
+            to_text("- a\n  - b\n  c\n\n  1. d\n\n     e\n- f"),
+            "- a\n  - b\n\n  c\n  1. d\n\n     e\n- f",
+        )
+        for options in ({}, {"toc": "t"}, {"table_engine": "fast"}):
+            results = Document(text + "\n" + TEXT,
+                               **options).render(("html", "text"))
+            self.assertEqual(results["html"],
+                             to_html(text + "\n" + TEXT, **options))
+            self.assertEqual(results["text"],
+                             to_text(text + "\n" + TEXT, **options))
+            doc = parse_file(io.StringIO(TEXT), **options)
+            self.assertEqual(doc.render(("html", ))["html"],
+                             to_html(TEXT, **options))
+
+    def test_emphasis(self):
+        text = "*bold* bold* *bold\\* \\*bold\\* \\*bold*"
+        self.assertEqual(
+            InlineText(text).to_html(),
+            "<b>bold</b> bold* <b>bold\\* \\*bold\\* \\*bold</b>",
+        )
+        text = "a /b/ =c=, (~d~) _e_ +f+ x*y* 中*文*。"
+        self.assertEqual(
+            InlineText(text).to_html(),
+            "a <i>b</i> <code>c</code>, (<code>d</code>) "
+            "<span style=\"text-decoration:underline\">e</span> "
+            "<del>f</del> x*y* 中<b>文</b>。",
+        )
+        for pattern in ("\\*a ", "/=x", "a* "):
+            text = pattern * 5000
+            self.assertEqual(InlineText(text, escape=False).to_html(), text)
+
+    def test_dispatch(self):
+        class CustomDocument(Document):
+            def parse_hr(self, index, lines):
+                block, index = super(CustomDocument, self).parse_hr(
+                    index, lines)
+                if block:
+                    self.rules = getattr(self, "rules", 0) + 1
+                return block, index
+
+        text = "#+TITLE: title\n-----\n * not headline\n\n-----"
+        doc = CustomDocument(text)
+        doc.to_html()
+        self.assertEqual(doc.properties["TITLE"], "title")
+        self.assertEqual(doc.rules, 2)
+        self.assertEqual(
+            [child.__class__.__name__ for child in doc.children],
+            ["Keyword", "Hr", "UnorderList", "Hr"],
+        )
+
+    def test_unterminated(self):
+        text = "#+BEGIN_SRC\n:PROPERTIES:\n#+BEGIN_QUOTE\ntext\n" \
+            "#+END_QUOTE\n:END:"
+        self.assertEqual(to_html(text), "<p>\n#+BEGIN_SRC\n</p>")
+
+        text = "#+BEGIN_SRC python\nx = 1\n#+BEGIN_SRC\n#+END_SRC"
+        self.assertEqual(
+            to_html(text),
+            "<pre class=\"src src-python\">\nx = 1\n#+BEGIN_SRC\n</pre>",
+        )
+
+    def test_custom_end(self):
+        class Note(Block):
+            @classmethod
+            def match(cls, line):
+                if line.strip() == "#+BEGIN_NOTE":
+                    return cls("note")
+
+            def matchend(self, index, lines):
+                return lines[index].strip() == "#+END"
+
+        class Notes(Drawer):
+            @classmethod
+            def match(cls, line):
+                if line.strip() == ":NOTES:":
+                    return cls("NOTES")
+
+            def matchend(self, index, lines):
+                return lines[index].strip() == ":DONE:"
+
+        class NoteDocument(Document):
+            def parse_block(self, index, lines):
+                block, num = self._parse_paired(Note, index, lines)
+                if block:
+                    return block, num
+                return super(NoteDocument, self).parse_block(index, lines)
+
+            def parse_drawer(self, index, lines):
+                drawer, num = self._parse_paired(Notes, index, lines)
+                if drawer:
+                    return drawer, num
+                return super(NoteDocument, self).parse_drawer(index, lines)
+
+        text = "#+BEGIN_NOTE\nhello\n#+END\n:NOTES:\nhidden\n:DONE:\n" \
+            "#+BEGIN_QUOTE\nq\n#+END_QUOTE"
+        self.assertEqual(
+            NoteDocument(text).to_html(),
+            "<p>\nhello\n</p>\n<blockquote>\n<p>\nq\n</p>\n</blockquote>",
+        )
+
+    def test_preparse_range(self):
+        lines = [
+            "* skipped",
+            "#+BEGIN_QUOTE",
+            "#+BEGIN_SRC python",
+            "x = 1",
+            "#+END_SRC",
+            "#+END_QUOTE",
+            "#+END_SRC",
+        ]
+        doc = Document("")
+        doc.preparse(lines, 1, 6)
+        self.assertEqual(
+            doc.to_html(),
+            "<blockquote>\n<pre class=\"src src-python\">\nx = 1\n</pre>"
+            "\n</blockquote>",
+        )
+
+    def test_iter_html(self):
+        self.assertEqual(
+            list(iter_html("* a\n- b\n| c |")),
+            [
+                '<h1 id="org-05186dbc27">a</h1>',
+                "<ul>\n", "<li>\n", "<p>\n", "b", "\n</p>", "\n</li>",
+                "\n</ul>", "\n", "<table>\n", "<tr>\n", "<td>", "c",
+                "</td>", "\n</tr>", "\n</table>"
+            ],
+        )
+        for options in ({}, {"toc": "t"}):
+            self.assertEqual(
+                "".join(iter_html(TEXT, **options)),
+                to_html(TEXT, **options),
+            )
+
+    def test_stream(self):
+        text = TEXT + "#+BEGIN_SRC\n* not a heading\n#+END_SRC\n* Heading4"
+        for options in ({}, {"toc": "t"}):
+            doc = parse_file(io.StringIO(text), **options)
+            self.assertEqual(doc.to_html(), to_html(text, **options))
+
+        read = []
+
+        def lines():
+            for line in ["* a", "text", "* b", "text", "* c", "text"]:
+                read.append(line)
+                yield line
+
+        nodes = Document.from_stream(lines()).iter_nodes()
+        self.assertEqual(next(nodes).title.strip(), "a")
+        self.assertEqual(len(read), 3)
+
+    def test_stream_subclass(self):
+        class Fence(Example):
+            @classmethod
+            def match(cls, line):
+                if line.startswith("```"):
+                    return cls()
+
+            def matchend(self, index, lines):
+                return lines[index].startswith("```")
+
+        class FenceDocument(Document):
+            parsed_nodes = ("fence", ) + Document.parsed_nodes
+
+            def parse_fence(self, index, lines):
+                return self._parse_paired(Fence, index, lines)
+
+        text = "* a\n```\n* not a heading\n```\n* b\ntext"
+        html = FenceDocument(text).to_html()
+        self.assertIn("* not a heading\n</pre>", html)
+        self.assertEqual(
+            FenceDocument.from_stream(io.StringIO(text)).to_html(), html)
+
+    def test_html_file(self):
+        for text in ("", TEXT, TEXT.replace("\n", "\r\n") + "中文\n\n\n"):
+            with tempfile.NamedTemporaryFile("wb", delete=False) as f:
+                f.write(text.encode("utf-8"))
+            try:
+                self.assertEqual(to_html_file(f.name), to_html(text))
+            finally:
+                os.remove(f.name)
+
+    def test_cache(self):
+        cache = LRUCache(max_entries=2)
+        html = to_html(TEXT, cache=cache)
+        self.assertEqual(to_html(TEXT, cache=cache), html)
+        self.assertNotEqual(to_html(TEXT, cache=cache, toc="t"), html)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+        to_html("* other", cache=cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertIsNone(cache.get(cache.key(TEXT)))
+
+        cache.resize(max_bytes=cache.bytes - 1)
+        self.assertEqual(len(cache), 1)
+
+    def test_render_many(self):
+        text = TEXT + "\n".join([
+            "- [X] <b>&</b> item",
+            "- [ ] item",
+            "| th | th |",
+            "|----+----|",
+            "| a  | b  |",
+        ])
+        for options in ({}, {"toc": "t"}, {"inline_engine": "fast"}):
+            doc = Document(text, **options)
+            html = doc.to_html()
+            self.assertEqual(html, to_html(text, **options))
+            for _ in range(3):
+                self.assertEqual(doc.to_html(), html)
+                self.assertEqual("".join(doc.iter_html()), html)
+
+    def test_shared_tree(self):
+        text = "\n".join([TEXT] * 10 + ["a /ii/ *b* [[x][y]] =c= \\\\"] * 20)
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for options in ({}, {"inline_engine": "fast"}):
+                html = to_html(text, **options)
+                doc = Document(text, **options)
+                doc.preparse(doc.lines)
+                results = []
+                threads = [
+                    threading.Thread(
+                        target=lambda: results.append(doc.to_html()))
+                    for _ in range(4)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(results, [html] * 4)
+                self.assertEqual(doc.to_html(), html)
+                for node, _, _ in doc.walk(inline=True):
+                    self.assertFalse(hasattr(node, "_delimiters"))
+        finally:
+            sys.setswitchinterval(interval)
+
+    def test_convert_many(self):
+        with tempfile.NamedTemporaryFile("wb", delete=False) as f:
+            f.write(TEXT.encode("utf-8"))
+        path = pathlib.Path(f.name)
+        missing = pathlib.Path(f.name + ".missing")
+        sources = [TEXT, path, "* a", missing, f.name] * 3
+        try:
+            for options in (
+                {"workers": 1},
+                {"workers": 2, "chunksize": 2},
+                {"workers": 2, "ordered": False, "toc": "t"},
+            ):
+                toc = options.get("toc")
+                results = list(convert_many(sources, **options))
+                self.assertEqual(len(results), len(sources))
+                if options.get("ordered", True):
+                    self.assertEqual([r.source for r in results], sources)
+                for result in results:
+                    if result.source is missing:
+                        self.assertIsNone(result.html)
+                        self.assertIsInstance(result.error, OSError)
+                        continue
+                    text = TEXT if result.source == path else result.source
+                    self.assertIsNone(result.error)
+                    self.assertEqual(result.html, to_html(text, toc=toc))
+
+            for workers in (1, 2):
+                results = list(
+                    convert_many([f.name, str(missing)],
+                                 workers=workers,
+                                 paths=True))
+                self.assertEqual(results[0].html, to_html(TEXT))
+                self.assertIsNone(results[1].html)
+                self.assertIsInstance(results[1].error, OSError)
+        finally:
+            os.remove(f.name)
+
+    def test_parallel(self):
+        text = "\n".join([
+            "intro",
+            "* TODO a",
+            "#+TODO: NEXT",
+            "* NEXT b",
+            ":PROPERTIES:",
+            ":CUSTOM_ID: b",
+            ":END:",
+            "#+BEGIN_SRC",
+            "* not a heading",
+            "#+END_SRC",
+            "** c",
+            "* d",
+            "#+OPTIONS: toc:t",
+        ]) + "\n" + TEXT
+        for options in ({}, {"offset": 1, "inline_engine": "fast"}):
+            self.assertEqual(
+                Document(text, **options).to_html(parallel=2),
+                Document(text, **options).to_html(),
+            )
+
+    def test_update(self):
+        lines = TEXT.splitlines() + [
+            "* Heading4",
+            "#+BEGIN_SRC",
+            "* not a heading",
+            "#+END_SRC",
+            "| a |",
+        ]
+        doc = Document("\n".join(lines), toc="t").update([])
+        self.assertEqual(doc.to_html(), to_html("\n".join(lines), toc="t"))
+
+        untouched = doc.parsed_sections[-1]
+        lines[9:9] = ["** Heading4.1", "text"]
+        doc.update([(9, 9, ["** Heading4.1", "text"])])
+        self.assertIs(doc.parsed_sections[-1], untouched)
+        self.assertEqual(doc.to_html(), to_html("\n".join(lines), toc="t"))
+
+        for edits in (
+            [(1, 2, "*** Heading2\n#+BEGIN_SRC")],
+            [(3, 3, ["#+END_SRC"]), (0, 1, [])],
+            [(1, 1, ["#+TODO: Heading3.2"])],
+            [(0, len(lines), [])],
+        ):
+            for start, stop, text in edits:
+                if isinstance(text, str):
+                    text = text.splitlines()
+                lines[start:stop] = text
+            doc.update(edits)
+            self.assertEqual(doc.to_html(),
+                             to_html("\n".join(lines), toc="t"))
+
+    def test_nesting(self):
+        depth = 2000
+        for lines in (
+            ["*" * num + " heading" for num in range(1, depth + 1)],
+            [" " * num + "- item" for num in range(depth)],
+        ):
+            doc = Document("\n".join(lines))
+            doc.preparse(doc.lines)
+            node, level = doc, 0
+            while node.children:
+                node, level = node.children[-1], level + 1
+            self.assertGreaterEqual(level, depth)
+
+    def test_file_store(self):
+        store = src.FileStore(tempfile.mkdtemp())
+        try:
+            threads = [
+                threading.Thread(target=store.set, args=("ab12", "html"))
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(store.get("ab12"), "html")
+            self.assertEqual(os.listdir(os.path.dirname(
+                store.filename("ab12"))), ["12.html"])
+
+            # a file where the store expects a directory cannot be written
+            blocked = src.FileStore(store.filename("ab12"))
+            blocked.set("cd34", "html")
+            self.assertIsNone(blocked.get("cd34"))
+        finally:
+            shutil.rmtree(store.path)
+
+    @unittest.skipIf(not src.available(), "pygments is not installed")
+    def test_highlight(self):
+        text = "#+BEGIN_SRC nosuchlang\nx = 1\n#+END_SRC"
+        src.timings.reset()
+        html = to_html(text, highlight=True)
+        self.assertEqual(src.timings.count, 1)
+        self.assertEqual(to_html(text, highlight=True, guess_lexer="language"),
+                         html)
+        self.assertEqual(
+            to_html(text, highlight=True, guess_lexer=False),
+            src.highlight("text", "x = 1"),
+        )
+        self.assertIs(src.get_lexer("python"), src.get_lexer("python"))
+
+        src.highlight_cache.clear()
+        src.store = src.FileStore(tempfile.mkdtemp())
+        try:
+            html = src.highlight("python", "x = 1")
+            filename = src.store.filename(src.highlight_key("python", "x = 1"))
+            with open(filename, "w") as f:
+                f.write("stored")
+            self.assertEqual(src.highlight("python", "x = 1"), html)
+            src.highlight_cache.clear()
+            self.assertEqual(src.highlight("python", "x = 1"), "stored")
+        finally:
+            shutil.rmtree(src.store.path)
+            src.store = None
+            src.highlight_cache.clear()
+
+    @unittest.skipIf(not src.available(), "pygments is not installed")
+    def test_highlight_executor(self):
+        text = "\n".join([
+            "#+BEGIN_SRC python\nx = 1\n#+END_SRC",
+            "* a\n#+BEGIN_SRC nosuchlang\n  (a)\n#+END_SRC",
+            "#+BEGIN_EXAMPLE\n<b>\n#+END_EXAMPLE",
+            "#+BEGIN_SRC nosuchlang\nx = 1\n#+END_SRC",
+        ])
+        with ProcessPoolExecutor(2) as executor:
+            for guess in (True, "language", False):
+                src.highlight_cache.clear()
+                src.guess_cache.clear()
+                html = to_html(text, highlight=True, guess_lexer=guess)
+
+                src.highlight_cache.clear()
+                src.guess_cache.clear()
+                self.assertEqual(
+                    to_html(text,
+                            highlight=True,
+                            guess_lexer=guess,
+                            highlight_executor=executor),
+                    html,
+                )
+
+            # blocks evicted from a small cache are not highlighted again
+            entries = src.highlight_cache.max_entries
+            html = to_html(text, highlight=True, guess_lexer=False)
+            src.highlight_cache.clear()
+            src.highlight_cache.resize(max_entries=1)
+            src.timings.reset()
+            try:
+                self.assertEqual(
+                    to_html(text,
+                            highlight=True,
+                            guess_lexer=False,
+                            highlight_executor=executor),
+                    html,
+                )
+                self.assertEqual(src.timings.count, 0)
+            finally:
+                src.highlight_cache.resize(max_entries=entries)
+
 
 if __name__ == '__main__':
     unittest.main()